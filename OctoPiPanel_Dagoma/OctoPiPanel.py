@@ -3,20 +3,36 @@
 __author__ = "Jonas Lorander"
 __license__ = "Simplified BSD 2-Clause License"
 
-import json
 import os
 import sys
 import pygame
 import pygbutton
-import requests
 import platform
 import datetime
+import time
+import socket
+import threading
 import subprocess
 from pygame.locals import *
-from collections import deque
 from ConfigParser import RawConfigParser
 
 import python_libs.draw.drawfunctions as draw
+import python_libs.draw.framebuffer as fbout
+import python_libs.draw.glyphatlas as glyphatlas
+import python_libs.draw.textcache as textcache
+import python_libs.metrics as metrics
+from python_libs.draw.assets import AssetManager, describe
+from python_libs.draw.damage import DamageTracker
+from python_libs.draw.dispatch import ButtonDispatcher
+from python_libs.draw.graph import TemperatureGraph
+from python_libs.octoprint.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from python_libs.octoprint.client import OctoPrintClient
+from python_libs.octoprint.commands import CommandDispatcher
+from python_libs.octoprint.history import TieredHistory
+from python_libs.octoprint.poller import StatePoller, EMPTY_STATE
+from python_libs.octoprint.push import PushListener
+from python_libs.octoprint.templog import TemperatureLog
+from python_libs.perf import LoopStats, clock
 
 device = "/dev/fb1"
 
@@ -26,8 +42,15 @@ WHITE = (255, 255, 255)
 BLUE =  (  0,   0, 255)
 GREEN = (  0, 255,   0)
 RED =   (255,   0,   0)
+YELLOW =(255, 255,   0)
 GRAY =	(160, 160, 160)
 
+# Events waking the main loop up: new printer state or finished command,
+# and the fallback timer of pygame versions whose event.wait has no timeout
+WAKE_EVENT = pygame.USEREVENT + 1
+TIMER_EVENT = pygame.USEREVENT + 2
+WAIT_TIMEOUT = pygame.version.vernum[0] >= 2
+
 class OctoPiPanel():
     """
     @var done: anything can set to True to forcequit
@@ -44,10 +67,26 @@ class OctoPiPanel():
     apikey = cfg.get('settings', 'apikey')
     updatetime = cfg.getint('settings', 'updatetime')
     backlightofftime = cfg.getint('settings', 'backlightofftime')
+
+    if cfg.has_option('settings', 'apitimeout'):
+        apitimeout = cfg.getint('settings', 'apitimeout')
+    else:
+        apitimeout = 5000
     
     hotendredIcon = cfg.get('icons', 'hotendredIcon')
-    hotendgreenIcon = cfg.get('icons', 'hotendredIcon')
-    hotendyellowIcon = cfg.get('icons', 'hotendredIcon')
+    hotendgreenIcon = cfg.get('icons', 'hotendgreenIcon')
+    hotendyellowIcon = cfg.get('icons', 'hotendyellowIcon')
+
+    # Longest wait between two tries while OctoPrint is unreachable
+    if cfg.has_option('settings', 'offlineretrymax'):
+        offlineretrymax = cfg.getint('settings', 'offlineretrymax')
+    else:
+        offlineretrymax = 60000
+
+    if cfg.has_option('settings', 'pushupdates'):
+        pushupdates = cfg.getboolean('settings', 'pushupdates')
+    else:
+        pushupdates = False
 
     if cfg.has_option('settings', 'window_width'):
         win_width = cfg.getint('settings', 'window_width')
@@ -59,15 +98,81 @@ class OctoPiPanel():
     else:
         win_height = 240
 
-    addkey = '?apikey={0}'.format(apikey)
     apiurl_printhead = '{0}/api/printer/printhead'.format(api_baseurl)
     apiurl_tool = '{0}/api/printer/tool'.format(api_baseurl)
     apiurl_bed = '{0}/api/printer/bed'.format(api_baseurl)
     apiurl_job = '{0}/api/job'.format(api_baseurl)
-    apiurl_status = '{0}/api/printer?apikey={1}'.format(api_baseurl, apikey)
+    apiurl_status = '{0}/api/printer'.format(api_baseurl)
     apiurl_connection = '{0}/api/connection'.format(api_baseurl)
+    apiurl_version = '{0}/api/version'.format(api_baseurl)
+
+    # Parts of the state (printer, job, connection) without which a poll is dropped
+    if cfg.has_option('settings', 'staterequired'):
+        staterequired = [part.strip() for part in cfg.get('settings', 'staterequired').split(',') if part.strip()]
+    else:
+        staterequired = []
+
+    if cfg.has_option('settings', 'historybuckets'):
+        historybuckets = [int(seconds) for seconds in cfg.get('settings', 'historybuckets').split(',') if seconds.strip()]
+    else:
+        historybuckets = [60, 600]
+
+    if cfg.has_option('settings', 'temperaturelog'):
+        temperaturelog = cfg.get('settings', 'temperaturelog').strip()
+    else:
+        temperaturelog = ''
+
+    if cfg.has_option('settings', 'temperaturelogsync'):
+        temperaturelogsync = cfg.getint('settings', 'temperaturelogsync')
+    else:
+        temperaturelogsync = 30000
+
+    if cfg.has_option('settings', 'framebuffer'):
+        framebuffer = cfg.get('settings', 'framebuffer').strip()
+    else:
+        framebuffer = ''
+
+    # Seconds between two lines of loop statistics printed, 0 for none
+    if cfg.has_option('settings', 'statslog'):
+        statslog = cfg.getint('settings', 'statslog')
+    else:
+        statslog = 0
+
+    # Poll intervals (ms) by what the printer does, see poll_interval()
+    if cfg.has_option('settings', 'pollfast'):
+        pollfast = cfg.getint('settings', 'pollfast')
+    else:
+        pollfast = 1000
+
+    if cfg.has_option('settings', 'pollprinting'):
+        pollprinting = cfg.getint('settings', 'pollprinting')
+    else:
+        pollprinting = updatetime
+
+    if cfg.has_option('settings', 'pollidle'):
+        pollidle = cfg.getint('settings', 'pollidle')
+    else:
+        pollidle = updatetime
+
+    if cfg.has_option('settings', 'pollsleep'):
+        pollsleep = cfg.getint('settings', 'pollsleep')
+    else:
+        pollsleep = 10000
+
+    # Fast polling lasts this long (ms) after a touch or a command
+    if cfg.has_option('settings', 'pollboost'):
+        pollboost = cfg.getint('settings', 'pollboost')
+    else:
+        pollboost = 10000
+
+    # TCP port of the Prometheus metrics endpoint (/metrics), 0 for none
+    if cfg.has_option('settings', 'metricsport'):
+        metricsport = cfg.getint('settings', 'metricsport')
+    else:
+        metricsport = 0
 
-    #print apiurl_job + addkey
+    # Holding the screen this long (ms) away from the buttons toggles the stats overlay
+    overlay_longpress = 1500
 
     graph_area_left   = 30 #6
     #graph_area_top    = 135
@@ -80,9 +185,9 @@ class OctoPiPanel():
     
     graph_XgridColor = GRAY
 
-    def __init__(self, caption="OctoPiPanel"):
+    def __init__(self, caption="OctoPiPanel", headless=False):
         """
-        .
+        headless - render with SDL's dummy video driver, no display needed.
         """
         # OctoPiPanel started
         print "OctoPiPanel starting !"
@@ -92,36 +197,106 @@ class OctoPiPanel():
         #self.color_bg = pygame.Color(41, 61, 70)
         self.color_bg = BLACK
 
+        # StageTimes recording the draw stages, for benchmarks
+        self.profile = None
+
+        # Loop stage times, API round trips and counters, see stats_snapshot()
+        self.stats = LoopStats()
+        self.stats_ticks = 0
+        self.overlay_on = False
+        self.overlay_lines = ()
+        self.overlay_ticks = 0
+        self.press = None # (ticks, pos) of a touch that may become a long press
+
         # Button settings
         self.leftPadding = 5
         self.buttonSpace = 10 if (self.win_width > 320) else 5
         self.buttonWidth = (self.win_width - self.leftPadding * 2 - self.buttonSpace * 2) / 3
         self.buttonHeight = 25
 
-        # Status flags
-        self.HotEndTemp = 0.0
-        self.BedTemp = 0.0
-        self.HotEndTempTarget = 0.0
-        self.BedTempTarget = 0.0
-        self.HotHotEnd = False
-        self.HotBed = False
-        self.Paused = False
-        self.Printing = False
-        self.JobLoaded = False
-        self.Completion = 0 # In procent
-        self.PrintTimeLeft = 0
-        self.Height = 0.0
-        self.FileName = "Nothing"
-        self.getstate_ticks = pygame.time.get_ticks()
-
-        # Lists for temperature data
-        self.HotEndTempList = deque([0] * self.graph_area_width)
-        self.BedTempList = deque([0] * self.graph_area_width)
+        # Temperature data, one sample (or one bucket when zoomed out) per graph pixel.
+        # The samples stay updatetime apart whatever the poll rate.
+        self.history = TieredHistory(self.graph_area_width, self.historybuckets, interval = self.updatetime / 1000.0)
+        self.HotEndTempList = self.history.raw.view('tool0')
+        self.BedTempList = self.history.raw.view('bed')
+        self.graph_zoom = 0 # index in self.history.levels
+
+        # One keep-alive connection pool for all API traffic
+        self.client = OctoPrintClient(self.apikey, self.apitimeout / 1000.0)
+        self.client.observe = self.observe_request
+
+        # Stops the polling of an unreachable OctoPrint, probes it with backoff instead
+        self.breaker = CircuitBreaker(backoff = self.updatetime / 1000.0, maxbackoff = self.offlineretrymax / 1000.0)
+        self.probetimeout = min(self.apitimeout, 2000) / 1000.0
+
+        # Set by the worker threads while a WAKE_EVENT is queued
+        self.wake_pending = threading.Event()
+
+        # Commands are posted by their own thread, buttons never wait
+        self.commands = CommandDispatcher(self.client, notify = self.wake)
+        self.commandError = None
+        self.commandError_ticks = 0
+
+        # Status flags, only ever set from state snapshots
+        self.state_sample = EMPTY_STATE.Sample
+        self.state_backfill = EMPTY_STATE.Backfill
+        self.apply_state(EMPTY_STATE)
+
+        # Seed the graph from OctoPrint's temperature history on the first
+        # poll, and again whenever OctoPrint comes back. Poller thread only.
+        self.backfill_needed = True
+        self.backfill_limit = self.graph_area_width * max(self.updatetime / 1000, 1)
+
+        # Optional per job temperature records, written by the poller and push threads
+        if self.temperaturelog:
+            self.templog = TemperatureLog(os.path.join(self.scriptDirectory, self.temperaturelog), self.temperaturelogsync / 1000.0)
+        else:
+            self.templog = None
+        self.templog_sample = EMPTY_STATE.Sample
+        self.templog_job = False # no file yet
+        self.templog_lock = threading.Lock()
+
+        # State acquisition runs in its own thread, the loop only reads snapshots
+        self.state_seq = 0
+        self.poller = StatePoller(self.get_state, self.updatetime / 1000.0, notify = self.wake)
+        self.pollboost_ticks = 0 # fast polling until then
+
+        # Optional Prometheus metrics, scraped from their own thread
+        self.metrics = None
+        self.metrics_server = None
+        if self.metricsport > 0:
+            registry = metrics.Registry()
+            try:
+                self.metrics_server = metrics.MetricsServer(registry, self.metricsport)
+            except socket.error as e:
+                print "Metrics port {0} unusable: {1}".format(self.metricsport, e)
+            else:
+                self.metrics = registry
+                self.metric_requests = registry.add(metrics.Histogram('octopipanel_api_request_seconds', "Round trip of the state requests, per endpoint.", metrics.LATENCY_BUCKETS, 'endpoint'))
+                self.metric_requestErrors = registry.add(metrics.Counter('octopipanel_api_request_errors_total', "State requests that failed, per endpoint.", 'endpoint'))
+                self.metric_polls = registry.add(metrics.Histogram('octopipanel_poll_seconds', "Round trip of a whole state poll, its requests run in parallel.", metrics.LATENCY_BUCKETS))
+                self.metric_commands = registry.add(metrics.Histogram('octopipanel_command_seconds', "Time from queueing a command to OctoPrint's answer.", metrics.LATENCY_BUCKETS))
+                self.metric_commandErrors = registry.add(metrics.Counter('octopipanel_command_errors_total', "Commands that failed."))
+                self.metric_frames = registry.add(metrics.Histogram('octopipanel_frame_seconds', "Main loop pass: events, state, update and drawing.", metrics.FRAME_BUCKETS))
+                self.metric_dropped = registry.add(metrics.Counter('octopipanel_dropped_frames_total', "Printer states replaced by a newer one before they were drawn."))
+                registry.add(metrics.Gauge('octopipanel_breaker_state', "State of the OctoPrint circuit breaker, 1 for the current one.",
+                                           lambda: dict((state, int(state == self.breaker.state)) for state in (CLOSED, HALF_OPEN, OPEN)), 'state'))
+                registry.add(metrics.Gauge('octopipanel_poll_interval_seconds', "Current interval between two state polls.", lambda: self.poller.interval))
+                registry.add(metrics.Gauge('process_resident_memory_bytes', "Resident memory size in bytes.", metrics.rss_bytes))
+
+        # Optional push updates, the poller takes over whenever they stop
+        if self.pushupdates:
+            self.push_sampled = 0.0
+            self.push = PushListener(self.client, self.api_baseurl, self.on_push)
+        else:
+            self.push = None
 
         #print self.HotEndTempList
         #print self.BedTempList
        
-        if platform.system() == 'Linux':
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        elif platform.system() == 'Linux':
 			if subprocess.Popen(["pidof", "X"], stdout=subprocess.PIPE).communicate()[0].strip() == "" :
 				disp_no = os.getenv("DISPLAY")
 				if disp_no:
@@ -146,12 +321,18 @@ class OctoPiPanel():
 					break
 
 				if not found:
-					raise Exception('No suitable video driver found!')
+					if not self.framebuffer:
+						raise Exception('No suitable video driver found!')
+					# The framebuffer output doesn't need SDL's display, but there is no touch input then
+					print 'No video driver, drawing to {0} only.'.format(self.framebuffer)
+					os.environ['SDL_VIDEODRIVER'] = 'dummy'
 
         # init pygame and set up screen
         pygame.init()
         disp_no = os.getenv("DISPLAY")
-        if disp_no:
+        if headless:
+            print "Running headless"
+        elif disp_no:
             print "I'm running under X display = {0}".format(disp_no)
             print "Mouse set to visible"
             pygame.mouse.set_visible(True)
@@ -169,19 +350,38 @@ class OctoPiPanel():
 	#self.screen = pygame.display.set_mode(modes[0], FULLSCREEN, 16)
         pygame.display.set_caption( caption )
 
+        # Optionally the screen goes straight to the framebuffer instead of through SDL
+        self.fbout = None
+        if self.framebuffer:
+            if not fbout.available():
+                print "The framebuffer output needs NumPy, using SDL's display."
+            else:
+                try:
+                    self.fbout = fbout.FramebufferOutput(self.framebuffer, self.screen.get_size())
+                except (IOError, OSError, RuntimeError) as e:
+                    print "Framebuffer {0} unusable, using SDL's display: {1}".format(self.framebuffer, e)
+
+        # Images and fonts, every cached surface is kept in the screen's format
+        self.assets = AssetManager(self.scriptDirectory)
+
+        # Tracks which parts of the screen need a redraw
+        self.damage = DamageTracker()
+
         # Set font
         #self.fntText = pygame.font.Font("Cyberbit.ttf", 12)
-        self.fntText = pygame.font.Font(os.path.join(self.scriptDirectory, "Cyberbit.ttf"), 14)
-        self.fntText.set_bold(True)
-        self.fntTextSmall = pygame.font.Font(os.path.join(self.scriptDirectory, "Cyberbit.ttf"), 12)
-        self.fntTextSmall.set_bold(True)
-        #self.fntTextBig = pygame.font.Font(os.path.join(self.scriptDirectory, "LCDM2B__.TTF"), 32)
-        self.fntTextBig = pygame.font.Font(os.path.join(self.scriptDirectory, "Dotmatrx.ttf"), 28)
-        self.fntTextBig.set_bold(True)
+        self.fntText = self.assets.font("Cyberbit.ttf", 14, bold = True)
+        self.fntTextSmall = self.assets.font("Cyberbit.ttf", 12, bold = True)
+        #self.fntTextBig = self.assets.font("LCDM2B__.TTF", 32)
+        self.fntTextBig = self.assets.font("Dotmatrx.ttf", 28, bold = True)
+
+        # Temperature graph, its axes and labels are drawn once and cached
+        self.graph = TemperatureGraph(self.graph_area_left, self.graph_area_top, self.graph_area_width, self.graph_area_height, self.fntTextSmall,
+                                      outline = self.graph_outline, bgcolor = self.color_bg, gridcolor = self.graph_XgridColor)
        
-        #self.hotendredIcon = pygame.image.load("icons/32/thermometer-2-32-red.png")
-        #self.hotendgreenIcon = pygame.image.load("icons/32/thermometer-2-32-green.png")
-        #self.hotendyellowIcon = pygame.image.load("icons/32/thermometer-2-32-yellow.png")
+        # Icons, loaded once in display format
+        self.hotendredIcon = self.assets.image(self.hotendredIcon)
+        self.hotendgreenIcon = self.assets.image(self.hotendgreenIcon)
+        self.hotendyellowIcon = self.assets.image(self.hotendyellowIcon)
         
         #self.fntText = pygame.font.Font(os.path.join(self.scriptDirectory, "Renegade Master.ttf"), 14)
         #self.fntText.set_bold(True)
@@ -213,6 +413,19 @@ class OctoPiPanel():
         self.btnReboot        = pygbutton.PygButton((  self.leftPadding + self.buttonWidth * 2 + self.buttonSpace * 2, self.win_height - self.buttonHeight * 2 - self.buttonSpace * 2, self.buttonWidth, self.buttonHeight), "Reboot");
         self.btnShutdown        = pygbutton.PygButton((  self.leftPadding + self.buttonWidth * 2 + self.buttonSpace * 2, self.win_height - self.buttonHeight - self.buttonSpace, self.buttonWidth, self.buttonHeight), "Shutdown");
 
+        # Pointer events only go to the buttons under the pointer
+        self.buttons = ButtonDispatcher()
+        self.buttons.add(self.btnHomeXY, self._home_xy)
+        #self.buttons.add(self.btnHomeZ, self._home_z)
+        self.buttons.add(self.btnZUp, self._z_up)
+        self.buttons.add(self.btnHeatBed, self._heat_bed)
+        self.buttons.add(self.btnHeatHotEnd, self._heat_hotend)
+        self.buttons.add(self.btnStartPrint, self._start_print)
+        self.buttons.add(self.btnAbortPrint, self._abort_print)
+        self.buttons.add(self.btnPausePrint, self._pause_print)
+        self.buttons.add(self.btnReboot, self._reboot)
+        self.buttons.add(self.btnShutdown, self._shutdown)
+
         # I couldnt seem to get at pin 252 for the backlight using the usual method, 
         # but this seems to work
         #if platform.system() == 'Linux':
@@ -234,16 +447,43 @@ class OctoPiPanel():
         
         
         """ game loop: input, move, render"""
+        self.poller.start()
+        self.commands.start()
+        if self.push is not None:
+            self.push.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+
+        self.stats_ticks = pygame.time.get_ticks() + self.statslog * 1000
+        events = pygame.event.get()
         while not self.done:
             #print('new loop')
-            # Handle events
-            self.handle_events()
+            started = mark = clock()
 
-            # Update info from printer every other seconds
-            if pygame.time.get_ticks() - self.getstate_ticks > self.updatetime:
-            	#print('get state')
-                self.get_state()
-                self.getstate_ticks = pygame.time.get_ticks()
+            # Handle events
+            self.handle_events(events)
+            self.wake_pending.clear()
+            mark = self.stats.lap('events', mark)
+
+            # Pick up the latest printer state, never waits for the API
+            seq, state = self.poller.latest()
+            if seq != self.state_seq:
+                # Snapshots published in between are never shown
+                dropped = seq - self.state_seq - 1
+                if dropped > 0:
+                    self.stats.count('dropped', dropped)
+                    if self.metrics is not None:
+                        self.metric_dropped.inc(dropped)
+
+                self.state_seq = seq
+                self.apply_state(state)
+                self.stats.count('states')
+            mark = self.stats.lap('state', mark)
+
+            # Report commands OctoPrint has answered
+            for command in self.commands.completed():
+                self.command_done(command)
+            mark = self.stats.lap('commands', mark)
 
             # Is it time to turn of the backlight?
             if self.backlightofftime > 0 and platform.system() == 'Linux':
@@ -256,14 +496,42 @@ class OctoPiPanel():
                     self.bglight_ticks = pygame.time.get_ticks()
                     self.bglight_on = False
             
+            # Poll as often as what the printer does deserves
+            self.poller.set_interval(self.poll_interval() / 1000.0)
+
             # Update buttons visibility, text, graphs etc
             self.update()
+            mark = self.stats.lap('update', mark)
 
             # Draw everything
             self.draw()
-            pygame.time.wait(500)
+            self.stats.lap('draw', mark)
+            elapsed = self.stats.end_frame(started)
+            if self.metrics is not None:
+                self.metric_frames.observe(elapsed)
+
+            if self.statslog > 0 and pygame.time.get_ticks() >= self.stats_ticks:
+                self.stats_ticks = pygame.time.get_ticks() + self.statslog * 1000
+                print "Stats: {0}".format(self.stats.report())
+
+            # Sleep until input arrives, the state changes or a timer is due
+            mark = clock()
+            events = self.wait_events(self.next_timer())
+            self.stats.add('wait', clock() - mark)
             
         """ Clean up """
+        self.poller.stop()
+        self.commands.stop()
+        if self.push is not None:
+            self.push.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.templog is not None:
+            self.templog.close()
+        if self.fbout is not None:
+            self.fbout.close()
+        self.client.close()
+
         # enable the backlight before quiting
         #if platform.system() == 'Linux':
             #os.system("echo '1' > /sys/class/gpio/gpio252/value")
@@ -276,9 +544,65 @@ class OctoPiPanel():
         """ Quit """
         pygame.quit()
        
-    def handle_events(self):
+    def wake(self):
+        """Wake the main loop up. Called by the worker threads."""
+        if self.wake_pending.is_set():
+            return
+        self.wake_pending.set()
+        try:
+            pygame.event.post(pygame.event.Event(WAKE_EVENT))
+        except pygame.error as e:
+            # Queue full or pygame going down, the loop still wakes on its timers
+            print "Wake up failed: {0}".format(e)
+
+    def next_timer(self):
+        """Return the milliseconds until the next timed change: backlight
+        off, command error expiry. Never more than updatetime, in case a
+        wake up got lost."""
+        now = pygame.time.get_ticks()
+        due = [now + self.updatetime]
+
+        if self.backlightofftime > 0 and platform.system() == 'Linux':
+            due.append(self.bglight_ticks + self.backlightofftime + 1)
+
+        if self.commandError is not None and now - self.commandError_ticks < 5000:
+            due.append(self.commandError_ticks + 5000)
+
+        if self.overlay_on:
+            due.append(self.overlay_ticks)
+
+        # The poll rate drops when the fast polling ends
+        if self.pollboost_ticks > now:
+            due.append(self.pollboost_ticks)
+
+        if self.statslog > 0:
+            due.append(self.stats_ticks)
+
+        return max(min(due) - now, 0)
+
+    def wait_events(self, timeout):
+        """Block until an event arrives or timeout milliseconds passed,
+        return the events queued then."""
+        if timeout <= 0:
+            return pygame.event.get()
+
+        if WAIT_TIMEOUT:
+            event = pygame.event.wait(timeout)
+        else:
+            pygame.time.set_timer(TIMER_EVENT, timeout)
+            event = pygame.event.wait()
+            pygame.time.set_timer(TIMER_EVENT, 0)
+
+        if event.type == pygame.NOEVENT:
+            return pygame.event.get()
+        return [event] + pygame.event.get()
+
+    def handle_events(self, events):
         """handle all events."""
-        for event in pygame.event.get():
+        # Buttons shown or hidden since the last events
+        self.buttons.refresh()
+
+        for event in events:
             if event.type == pygame.QUIT:
                 print "quit"
 		self.done = True
@@ -290,6 +614,8 @@ class OctoPiPanel():
                 if event.key == pygame.K_SPACE:
                     print "Got space key, recording screenshot"
                     pygame.image.save(self.screen, "screenshot.jpg")
+                if event.key == pygame.K_o:
+                    self.toggle_overlay()
 		    
 
                 # Look for specific keys.
@@ -301,41 +627,34 @@ class OctoPiPanel():
             # It should only be possible to click a button if you can see it
             #  e.g. the backlight is on
             if self.bglight_on == True:
-                if 'click' in self.btnHomeXY.handleEvent(event):
-                    self._home_xy()
-
-                #if 'click' in self.btnHomeZ.handleEvent(event):
-                    #self._home_z()
-
-                if 'click' in self.btnZUp.handleEvent(event):
-                    self._z_up()
-
-                if 'click' in self.btnHeatBed.handleEvent(event):
-                    self._heat_bed()
-
-                if 'click' in self.btnHeatHotEnd.handleEvent(event):
-                    self._heat_hotend()
-
-                if 'click' in self.btnStartPrint.handleEvent(event):
-                    self._start_print()
-
-                if 'click' in self.btnAbortPrint.handleEvent(event):
-                    self._abort_print()
-
-                if 'click' in self.btnPausePrint.handleEvent(event):
-                    self._pause_print()
-
-                if 'click' in self.btnReboot.handleEvent(event):
-                    self._reboot()
-
-                if 'click' in self.btnShutdown.handleEvent(event):
-                    self._shutdown()
+                self.buttons.dispatch(event)
+
+                # Tapping the graph zooms out, back to the samples after the coarsest level
+                if event.type == pygame.MOUSEBUTTONDOWN and self.graph.rect.collidepoint(event.pos):
+                    self.graph_zoom = (self.graph_zoom + 1) % len(self.history.levels)
+
+                # A long press off the buttons and the graph toggles the stats overlay
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    if not self.buttons.hit(event.pos) and not self.graph.rect.collidepoint(event.pos):
+                        self.press = (pygame.time.get_ticks(), event.pos)
+                    else:
+                        self.press = None
+                if event.type == pygame.MOUSEBUTTONUP and self.press is not None:
+                    ticks, pos = self.press
+                    self.press = None
+                    if pygame.time.get_ticks() - ticks >= self.overlay_longpress and abs(event.pos[0] - pos[0]) + abs(event.pos[1] - pos[1]) < 20:
+                        self.toggle_overlay()
             
             # Did the user click on the screen?
             if event.type == pygame.MOUSEBUTTONDOWN:
                 # Reset backlight counter
                 self.bglight_ticks = pygame.time.get_ticks()
 
+                # Someone is looking, get fresh numbers now and keep them coming
+                if self.poller.interval > self.pollfast / 1000.0:
+                    self.poller.poll_now()
+                self.pollboost_ticks = pygame.time.get_ticks() + self.pollboost
+
                 if self.bglight_on == False and platform.system() == 'Linux':
                     # enable the backlight
                     #os.system("echo '1' > /sys/class/gpio/gpio252/value")
@@ -344,79 +663,257 @@ class OctoPiPanel():
                     self.bglight_on = True
                     print "Background light on."
 
+    """
+    Return the poll interval (ms) for the current state: pollfast after a
+    touch or a command and while the hot end is away from its target,
+    pollprinting during a job, else pollidle, or pollsleep once the
+    backlight is off.
+    """
+    def poll_interval(self):
+        if pygame.time.get_ticks() < self.pollboost_ticks:
+            return self.pollfast
+        if self.HotEndTempTarget > 0 and abs(self.HotEndTemp - self.HotEndTempTarget) > 2:
+            return self.pollfast
+        if self.Printing or self.Paused:
+            return self.pollprinting
+        if not self.bglight_on:
+            return self.pollsleep
+        return self.pollidle
+
     """
     Get status update from API, regarding temp etc.
+    Runs on the poller thread: it must not touch pygame or self's status
+    flags, it builds a new snapshot from the previous one instead.
     """
-    def get_state(self):
-        try:
-            req = requests.get(self.apiurl_status)
+    def get_state(self, previous):
+        # While push updates flow the poll is not needed, unless OctoPrint
+        # was found unreachable and the pushes haven't told otherwise yet
+        if self.push is not None and self.push.connected and self.breaker.state == CLOSED:
+            return None
+
+        # OctoPrint is unreachable, don't hammer it, wait for the next probe
+        if not self.breaker.allow():
+            return None
+
+        if self.breaker.state == HALF_OPEN:
+            # A single cheap request to find out if OctoPrint is back. The
+            # breaker stays half-open until the poll below gets answers.
+            if not self.client.ping(self.apiurl_version, self.probetimeout):
+                self.breaker.failure()
+                return None
+
+        # The three requests are independent, fetch them all at once
+        printerUrl = self.apiurl_status
+        if self.backfill_needed:
+            printerUrl += '?history=true&limit={0}'.format(self.backfill_limit)
+
+        started = clock()
+        replies = self.client.get_json_all({
+            'printer': printerUrl,
+            'job': self.apiurl_job,
+            'connection': self.apiurl_connection })
+        self.observe_request('poll', clock() - started, any(reply is not None for reply in replies.values()))
+
+        # No answer at all, OctoPrint is down
+        if all(reply is None for reply in replies.values()):
+            self.breaker.failure()
+            if self.breaker.state == OPEN:
+                print "OctoPrint offline, next try in {0:.1f}s".format(self.breaker.delay)
+                self.backfill_needed = True
+                return previous._replace(Online = False)
+            return None
+
+        self.breaker.success()
+        state = previous._replace(Online = True)
+
+        # Missing required parts drop the update, the previous snapshot stays
+        for name in self.staterequired:
+            if replies.get(name) is None:
+                return None
+
+        # Parts that didn't arrive keep their last good values
+        printerState = replies['printer']
+        if printerState is not None:
+            # Set status flags
+            tempKey = 'temps' if 'temps' in printerState else 'temperature'
+            HotEndTemp = printerState[tempKey]['tool0']['actual']
+            #BedTemp = printerState[tempKey]['bed']['actual']
+            HotEndTempTarget = printerState[tempKey]['tool0']['target']
+            #BedTempTarget = printerState[tempKey]['bed']['target']
+
+            if HotEndTempTarget == None:
+                HotEndTempTarget = 0.0
+
+            #if BedTempTarget == None:
+                #BedTempTarget = 0.0
+            #HotBed = BedTempTarget > 0.0
+
+            state = state._replace(
+                HotEndTemp = HotEndTemp,
+                HotEndTempTarget = HotEndTempTarget,
+                BedTempTarget = 0.0,
+                HotHotEnd = HotEndTempTarget > 0.0,
+                HotBed = False,
+                # Temperatures go to the graph lists
+                Sample = previous.Sample + 1)
+
+            if self.backfill_needed and 'history' in printerState[tempKey]:
+                self.backfill_needed = False
+                state = state._replace(Backfill = self.history_samples(printerState[tempKey]['history']))
+
+        # Get info about current job
+        jobState = replies['job']
+        if jobState is not None:
+            state = state._replace(
+                Completion = jobState['progress']['completion'], # In procent
+                PrintTimeLeft = jobState['progress']['printTimeLeft'],
+                #Height = printerState['currentZ'],
+                FileName = jobState['job']['file']['name'])
+
+        connState = replies['connection']
+        if connState is not None:
+            state = state._replace(
+                Paused = connState['current']['state'] == "Paused",
+                Printing = connState['current']['state'] == "Printing")
+
+        if jobState is not None and connState is not None:
+            state = state._replace(
+                JobLoaded = connState['current']['state'] == "Operational" and (jobState['job']['file']['name'] != "") or (jobState['job']['file']['name'] != None))
+
+        self.log_state(state)
+        return state
 
-            if req.status_code == 200:
-                state = json.loads(req.text)
-        
-                # Set status flags
-                tempKey = 'temps' if 'temps' in state else 'temperature'
-                self.HotEndTemp = state[tempKey]['tool0']['actual']
-                #self.BedTemp = state[tempKey]['bed']['actual']
-                self.HotEndTempTarget = state[tempKey]['tool0']['target']
-                #self.BedTempTarget = state[tempKey]['bed']['target']
-
-                if self.HotEndTempTarget == None:
-                    self.HotEndTempTarget = 0.0
-
-                #if self.BedTempTarget == None:
-                    #self.BedTempTarget = 0.0
-                self.BedTempTarget = 0.0
-        
-                if self.HotEndTempTarget > 0.0:
-                    self.HotHotEnd = True
-                else:
-                    self.HotHotEnd = False
-
-                #if self.BedTempTarget > 0.0:
-                    #self.HotBed = True
-                #else:
-                    #self.HotBed = False
-                self.HotBed = False
-
-                #print self.apiurl_status
-            elif req.status_code == 401:
-                print "Error: {0}".format(req.text)
-                
-            # Get info about current job
-            req = requests.get(self.apiurl_job + self.addkey)
-            if req.status_code == 200:
-                jobState = json.loads(req.text)
-
-            req = requests.get(self.apiurl_connection + self.addkey)
-            if req.status_code == 200:
-                connState = json.loads(req.text)
-
-                #print self.apiurl_job + self.addkey
-            
-                self.Completion = jobState['progress']['completion'] # In procent
-                self.PrintTimeLeft = jobState['progress']['printTimeLeft']
-                #self.Height = state['currentZ']
-                self.FileName = jobState['job']['file']['name']
-                self.JobLoaded = connState['current']['state'] == "Operational" and (jobState['job']['file']['name'] != "") or (jobState['job']['file']['name'] != None)
+    """
+    Record a new temperature sample in the temperature log, starting a new
+    file whenever a print job starts or ends. Called by the poller and
+    the push listener thread with each snapshot they make.
+    """
+    def log_state(self, state):
+        if self.templog is None:
+            return
 
-                # Save temperatures to lists
-                self.HotEndTempList.popleft()
-                self.HotEndTempList.append(self.HotEndTemp)
-                #self.BedTempList.popleft()
-                #self.BedTempList.append(self.BedTemp)
+        with self.templog_lock:
+            if state.Sample == self.templog_sample:
+                return
+            self.templog_sample = state.Sample
 
-                #print self.HotEndTempList
-                #print self.BedTempList
+            job = state.FileName if (state.Printing or state.Paused) else None
+            if job != self.templog_job:
+                self.templog_job = job
+                self.templog.rotate(job)
 
-                self.Paused = connState['current']['state'] == "Paused"
-                self.Printing = connState['current']['state'] == "Printing"
+            self.templog.append(time.time(), state.HotEndTemp, state.HotEndTempTarget, state.BedTemp, state.BedTempTarget)
 
-                
-        except requests.exceptions.ConnectionError as e:
-            print "Connection Error ({0}): {1}".format(e.errno, e.strerror)
+    """
+    Handle a message from the push API. 'current' and 'history' carry the
+    same state as the three polled endpoints, merge them the same way.
+    Runs on the push listener thread.
+    """
+    def on_push(self, key, payload):
+        if key in ('current', 'history'):
+            state = self.poller.update(lambda previous: self.get_push_state(previous, payload, key == 'history'))
+            # Every pushed sample goes to the log, not only the one a poll
+            # finds. Out of the poller's lock, the UI never waits on the disk.
+            if state is not None:
+                self.log_state(state)
+
+    def get_push_state(self, previous, data, backfill=False):
+        # A message got through, OctoPrint is back if it was gone
+        self.breaker.success()
+        state = previous._replace(Online = True)
+
+        # 'history' comes first on every (re)connection, with the temperatures so far
+        if backfill and data.get('temps'):
+            state = state._replace(Backfill = self.history_samples(data['temps']))
+
+        temps = data.get('temps')
+        if temps and 'tool0' in temps[-1]:
+            HotEndTemp = temps[-1]['tool0']['actual']
+            HotEndTempTarget = temps[-1]['tool0']['target']
+            #BedTemp = temps[-1]['bed']['actual']
+            #BedTempTarget = temps[-1]['bed']['target']
+
+            if HotEndTempTarget == None:
+                HotEndTempTarget = 0.0
+
+            state = state._replace(
+                HotEndTemp = HotEndTemp,
+                HotEndTempTarget = HotEndTempTarget,
+                BedTempTarget = 0.0,
+                HotHotEnd = HotEndTempTarget > 0.0,
+                HotBed = False)
+
+            # Pushes come every 0.5s, keep the graph at one sample per updatetime
+            now = time.time()
+            if now - self.push_sampled >= self.updatetime / 1000.0:
+                self.push_sampled = now
+                state = state._replace(Sample = previous.Sample + 1)
+
+        if data.get('progress') is not None and data.get('job') is not None:
+            state = state._replace(
+                Completion = data['progress']['completion'], # In procent
+                PrintTimeLeft = data['progress']['printTimeLeft'],
+                #Height = data['currentZ'],
+                FileName = data['job']['file']['name'])
+
+        if data.get('state') is not None:
+            state = state._replace(
+                Paused = data['state']['text'] == "Paused",
+                Printing = data['state']['text'] == "Printing")
+
+            if data.get('job') is not None:
+                state = state._replace(
+                    JobLoaded = data['state']['text'] == "Operational" and (data['job']['file']['name'] != "") or (data['job']['file']['name'] != None))
+
+        return state
 
-        return
+    """
+    Turn OctoPrint's temperature history entries into (timestamp, values)
+    samples for TieredHistory.backfill.
+    """
+    def history_samples(self, entries):
+        samples = []
+        for entry in entries:
+            if entry.get('time') is None or entry.get('tool0', {}).get('actual') is None:
+                continue
+            samples.append((entry['time'], { 'tool0': entry['tool0']['actual'] }))
+            #samples.append((entry['time'], { 'tool0': entry['tool0']['actual'], 'bed': entry['bed']['actual'] }))
+        samples.sort(key = lambda sample: sample[0])
+        return tuple(samples)
+
+    """
+    Copy a state snapshot into the status flags, on the UI thread.
+    """
+    def apply_state(self, state):
+        self.HotEndTemp = state.HotEndTemp
+        self.BedTemp = state.BedTemp
+        self.HotEndTempTarget = state.HotEndTempTarget
+        self.BedTempTarget = state.BedTempTarget
+        self.HotHotEnd = state.HotHotEnd
+        self.HotBed = state.HotBed
+        self.Paused = state.Paused
+        self.Printing = state.Printing
+        self.JobLoaded = state.JobLoaded
+        self.Completion = state.Completion # In procent
+        self.PrintTimeLeft = state.PrintTimeLeft
+        self.Height = state.Height
+        self.FileName = state.FileName
+        self.Online = state.Online
+
+        # A new tuple each time a history arrives, later snapshots share it
+        if state.Backfill is not self.state_backfill:
+            self.state_backfill = state.Backfill
+            if state.Backfill:
+                self.history.backfill(state.Backfill, self.updatetime / 1000.0)
+                # The backfill ends with the temperature of this snapshot
+                self.state_sample = state.Sample
+
+        if state.Sample != self.state_sample:
+            self.state_sample = state.Sample
+
+            # Save temperatures to the history
+            self.history.append({ 'tool0': state.HotEndTemp })
+            #self.history.append({ 'tool0': state.HotEndTemp, 'bed': state.BedTemp })
 
     """
     Update buttons, text, graphs etc.
@@ -458,25 +955,23 @@ class OctoPiPanel():
         return
                
     def draw(self):
-        #clear whole screen
-        self.screen.fill( self.color_bg )
-
-        # Draw buttons
-        self.btnHomeXY.draw(self.screen)
-        #self.btnHomeZ.draw(self.screen)
-        self.btnZUp.draw(self.screen)
-        #self.btnHeatBed.draw(self.screen)
-        self.btnHeatHotEnd.draw(self.screen)
-        self.btnStartPrint.draw(self.screen)
-        self.btnAbortPrint.draw(self.screen)
-        self.btnPausePrint.draw(self.screen)
-        self.btnReboot.draw(self.screen)
-        self.btnShutdown.draw(self.screen)
+        # Place time left and completetion texts
+        if self.JobLoaded == False or self.PrintTimeLeft == None or self.Completion == None:
+            self.Completion = 0
+            self.PrintTimeLeft = 0;
+
+        # Describe what is on screen, in drawing order. Only widgets whose
+        # rect or key changed since the last frame get repainted.
+        widgets = []
+
+        # Buttons
+        for name in ('btnHomeXY', 'btnZUp', 'btnHeatHotEnd', 'btnStartPrint', 'btnAbortPrint', 'btnPausePrint', 'btnReboot', 'btnShutdown'):
+            btn = getattr(self, name)
+            widgets.append((name, btn.rect, (btn.visible, btn.caption, btn.buttonDown, btn.mouseOverButton), lambda btn=btn: btn.draw(self.screen)))
 
         # Place temperatures texts       
         #lblHotEndTemp = self.fntText.render(u'Hot end: {0}\N{DEGREE SIGN}C ({1}\N{DEGREE SIGN}C)'.format(self.HotEndTemp, self.HotEndTempTarget), 1, (220, 0, 0))
         #self.screen.blit(lblHotEndTemp, (self.leftPadding + self.buttonWidth + self.buttonSpace, 5))
-        #draw.draw_text(self.screen, u'Hot end: {0}\N{DEGREE SIGN}C ({1}\N{DEGREE SIGN}C)'.format(self.HotEndTemp, self.HotEndTempTarget), (160, 5), "center", self.fntTextBig)
         
         if (self.HotEndTemp < self.HotEndTempTarget - 1):
             color=YELLOW
@@ -489,100 +984,149 @@ class OctoPiPanel():
             icon = self.hotendgreenIcon
             
         #draw.draw_image(self.screen, icon, (0 , 0) , align = "left" )
-        
-              
-        #draw.draw_text(self.screen, u'{0} ({1})'.format(self.HotEndTemp, self.HotEndTempTarget), ( (self.win_width / 2) + (icon.get_width() / 2) , 5), "center", self.fntTextBig, color=color, outline=False)
-        draw.draw_text(self.screen, u'{0} ({1})'.format(self.HotEndTemp, self.HotEndTempTarget), ( self.win_width / 2 , 5), "center", self.fntTextBig, color=color, outline=False)
+
+        if self.Online:
+            # Digits only, composed from pre-rendered glyphs
+            self._add_numeric_text(widgets, 'lblHotEndTemp', u'{0} ({1})'.format(self.HotEndTemp, self.HotEndTempTarget), ( self.win_width / 2 , 5), glyphatlas.get_atlas(self.fntTextBig, color))
+        else:
+            self._add_text(widgets, 'lblHotEndTemp', "Offline", ( self.win_width / 2 , 5), "center", self.fntTextBig, RED)
         
         #lblBedTemp = self.fntText.render(u'Bed: {0}\N{DEGREE SIGN}C ({1}\N{DEGREE SIGN}C)'.format(self.BedTemp, self.BedTempTarget), 1, (66, 100, 255))
         #self.screen.blit(lblBedTemp, (self.leftPadding + self.buttonWidth + self.buttonSpace, 75))
 
-        # Place time left and completetion texts
-        if self.JobLoaded == False or self.PrintTimeLeft == None or self.Completion == None:
-            self.Completion = 0
-            self.PrintTimeLeft = 0;
+        self._add_text(widgets, 'lblPrintTimeLeft', "ETA : {0}".format(datetime.timedelta(seconds = self.PrintTimeLeft)), (self.leftPadding + self.buttonWidth + self.buttonSpace , 90), "left", self.fntText, WHITE)
+        self._add_text(widgets, 'lblCompletion', "Completed : {0:.1f}%".format(self.Completion), (self.leftPadding + self.buttonWidth + self.buttonSpace , 105), "left", self.fntText, WHITE)
+
+        # Last failed command, for a few seconds
+        if self.commandError is not None and pygame.time.get_ticks() - self.commandError_ticks < 5000:
+            self._add_text(widgets, 'lblCommandError', self.commandError, (self.leftPadding + self.buttonWidth + self.buttonSpace , 125), "left", self.fntTextSmall, RED)
+
+        # Temperature graph, changes with every sample and with the targets
+        level = self.history.levels[self.graph_zoom]
+        widgets.append(('graph', self.graph.rect, (self.graph_zoom, level.count, self.HotEndTempTarget, self.BedTempTarget), self.draw_graph))
+
+        # Time scale of the zoomed out graph
+        if self.graph_zoom > 0:
+            if level.seconds % 60 == 0:
+                scale = "{0} min/px".format(level.seconds / 60)
+            else:
+                scale = "{0} s/px".format(level.seconds)
+            self._add_text(widgets, 'lblGraphZoom', scale, (self.graph_area_left + self.graph_area_width - 4, self.graph_area_top + 3), "right", self.fntTextSmall, GRAY)
+
+        # Loop statistics, on top of everything
+        if self.overlay_on:
+            self._add_overlay(widgets)
+
+        dirty = self.damage.repaint(self.screen, widgets, self.color_bg, self.profile)
+
+        # update the changed parts of the screen only
+        if dirty:
+            started = clock()
+            self.display_update(dirty)
+            elapsed = clock() - started
+            if self.profile is not None:
+                self.profile.add('display', elapsed)
+            self.stats.add('display', elapsed)
+            self.stats.count('repaints')
+
+    def display_update(self, rects):
+        if self.fbout is not None:
+            self.fbout.update(self.screen, rects)
+        else:
+            pygame.display.update(rects)
 
-        #lblPrintTimeLeft = self.fntText.render("Time left: {0}".format(datetime.timedelta(seconds = self.PrintTimeLeft)), 1, (200, 200, 200))
-        #self.screen.blit(lblPrintTimeLeft, (self.leftPadding + self.buttonWidth + self.buttonSpace, 90))
+    """
+    Return (name, format) of the cached surfaces that aren't in the
+    screen's pixel format, each of their blits converts them.
+    """
+    def check_formats(self):
+        surfaces = [("text {0!r}".format(key[4]), surface) for key, surface in textcache.cache.items()]
+        surfaces += glyphatlas.surfaces()
+        surfaces += [("graph background", self.graph._background), ("graph outline", self.graph._overlay), ("graph plot", self.graph._plot)]
+        surfaces += pygbutton.surfaces()
 
-        #lblCompletion = self.fntText.render("Completion: {0:.1f}%".format(self.Completion), 1, (200, 200, 200))
-        #self.screen.blit(lblCompletion, (self.leftPadding + self.buttonWidth + self.buttonSpace, 105))
-        
-        
-        
-        draw.draw_text(self.screen, "ETA : {0}".format(datetime.timedelta(seconds = self.PrintTimeLeft)), (self.leftPadding + self.buttonWidth + self.buttonSpace , 90), "left", self.fntText, color=WHITE, outline=False)
-        draw.draw_text(self.screen, "Completed : {0:.1f}%".format(self.Completion), (self.leftPadding + self.buttonWidth + self.buttonSpace , 105), "left", self.fntText, color=WHITE, outline=False)
-
-        # Temperature Graphing
-        # Graph area
-        # pygame.draw.rect(self.screen, (255, 255, 255), (self.graph_area_left, self.graph_area_top, self.graph_area_width, self.graph_area_height))
-        #draw.draw_roundrect(self.screen, (255, 255, 255), pygame.Rect( self.graph_area_left, self.graph_area_top, self.graph_area_width, self.graph_area_height ), 2, 10, 10)
-
-        # Graph axes
-        # X, temp
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left, self.graph_area_top], [self.graph_area_left, self.graph_area_top + self.graph_area_height], 2)
-
-        # X-axis divisions
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 5], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 5], 2) # 0
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 4], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 4], 2) # 50
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 3], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 3], 2) # 100
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 2], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 2], 2) # 150
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 1], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 1], 2) # 200
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left - 3, self.graph_area_top + (self.graph_area_height / 5) * 0], [self.graph_area_left, self.graph_area_top + (self.graph_area_height / 5) * 0], 2) # 250
-
-        # X-axis scale
-        lbl0 = self.fntTextSmall.render("0", 1, (200, 200, 200))
-        self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 5 - (self.graph_area_height / 22 ) ) )
-        lbl0 = self.fntTextSmall.render("50", 1, (200, 200, 200))
-        self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 4 - (self.graph_area_height / 22 ) ) )
-        lbl0 = self.fntTextSmall.render("100", 1, (200, 200, 200))
-        self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 3 - (self.graph_area_height / 22 ) ) )
-        lbl0 = self.fntTextSmall.render("150", 1, (200, 200, 200))
-        self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 2 - (self.graph_area_height / 22 ) ) )
-        lbl0 = self.fntTextSmall.render("200", 1, (200, 200, 200))
-        self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 1 - (self.graph_area_height / 22 ) ) )
-        lbl0 = self.fntTextSmall.render("250", 1, (200, 200, 200))
-        self.screen.blit(lbl0, (self.graph_area_left - 26, self.graph_area_top - 6 + (self.graph_area_height / 5) * 0 - (self.graph_area_height / 22 ) ) )
- 
-        # X-axis divisions, grey lines
-        pygame.draw.line(self.screen, self.graph_XgridColor, [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 4], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 4], 1) # 50
-        pygame.draw.line(self.screen, self.graph_XgridColor, [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 3], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 3], 1) # 100
-        pygame.draw.line(self.screen, self.graph_XgridColor, [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 2], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 2], 1) # 150
-        pygame.draw.line(self.screen, self.graph_XgridColor, [self.graph_area_left + 2, self.graph_area_top + (self.graph_area_height / 5) * 1], [self.graph_area_left + self.graph_area_width - 2, self.graph_area_top + (self.graph_area_height / 5) * 1], 1) # 200
-        
-        # Y, time, 2 seconds per pixel
-        pygame.draw.line(self.screen, (0, 0, 0), [self.graph_area_left, self.graph_area_top + self.graph_area_height], [self.graph_area_left + self.graph_area_width, self.graph_area_top + self.graph_area_height], 2)
-        
-        # Scaling factor
-        g_scale = self.graph_area_height / 250.0
-
-        # Print temperatures for hot end
-        i = 0
-        for t in self.HotEndTempList:
-            x = self.graph_area_left + i
-            y = self.graph_area_top + self.graph_area_height - int(t * g_scale)
-            pygame.draw.line(self.screen, (220, 0, 0), [x, y], [x + 1, y], 2)
-            i += 1
-
-        # Print temperatures for bed
-        i = 0
-        for t in self.BedTempList:
-            x = self.graph_area_left + i
-            y = self.graph_area_top + self.graph_area_height - int(t * g_scale)
-            pygame.draw.line(self.screen, (0, 0, 220), [x, y], [x + 1, y], 2)
-            i += 1
-
-        # Draw target temperatures
-        # Hot end 
-        pygame.draw.line(self.screen, WHITE, [self.graph_area_left, self.graph_area_top + self.graph_area_height - (self.HotEndTempTarget * g_scale)], [self.graph_area_left + self.graph_area_width - self.graph_outline, self.graph_area_top + self.graph_area_height - (self.HotEndTempTarget * g_scale)], 1);
-        # Bed
-        pygame.draw.line(self.screen, (40, 40, 180), [self.graph_area_left, self.graph_area_top + self.graph_area_height - (self.BedTempTarget * g_scale)], [self.graph_area_left + self.graph_area_width  - self.graph_outline, self.graph_area_top + self.graph_area_height - (self.BedTempTarget * g_scale)], 1);
-        
-        draw.draw_roundrect(self.screen, (255, 255, 255), pygame.Rect( self.graph_area_left, self.graph_area_top, self.graph_area_width, self.graph_area_height ), self.graph_outline, 10, 10)
-            
-        
-        # update screen
-        pygame.display.update()
+        mismatches = self.assets.check(surfaces)
+        for name, description in mismatches:
+            print "Not in display format ({0}): {1}, {2}".format(describe(self.screen), name, description)
+        return mismatches
+
+    """
+    Return the loop statistics as a dict: 'fps', 'frames', 'loop' (stage
+    times: events, state, commands, update, draw with display in it,
+    display, wait and the whole loop without the wait), 'api' (round trips: poll and each
+    endpoint) as percentiles in ms, and 'counters'. Any thread.
+    """
+    def stats_snapshot(self):
+        return self.stats.snapshot()
+
+    """
+    Record the round trip of an API request: 'poll' for a whole state
+    poll, else the endpoint's name. Any thread.
+    """
+    def observe_request(self, name, seconds, ok):
+        self.stats.request(name, seconds, ok)
+        if self.metrics is None:
+            return
+        if name == 'poll':
+            self.metric_polls.observe(seconds)
+        else:
+            self.metric_requests.observe(seconds, name)
+            if not ok:
+                self.metric_requestErrors.inc(value = name)
+
+    def toggle_overlay(self):
+        self.overlay_on = not self.overlay_on
+        self.overlay_ticks = 0
+
+    def _add_overlay(self, widgets):
+        # The numbers change once a second, not with every frame they cause
+        now = pygame.time.get_ticks()
+        if now >= self.overlay_ticks:
+            self.overlay_ticks = now + 1000
+            snapshot = self.stats.snapshot()
+            loop = snapshot['loop'].get('loop', {'p50': 0.0, 'p99': 0.0})
+            poll = snapshot['api'].get('poll', {'p50': 0.0, 'p99': 0.0})
+            self.overlay_lines = (
+                "{0:.1f} fps".format(snapshot['fps']),
+                "loop {0:.1f}/{1:.1f} ms".format(loop['p50'], loop['p99']),
+                "API {0:.0f}/{1:.0f} ms".format(poll['p50'], poll['p99']))
+
+        lines = self.overlay_lines
+        font = self.fntTextSmall
+        lineHeight = font.get_linesize()
+        width = max(font.size(line)[0] for line in lines) + 4
+        rect = pygame.Rect(self.graph_area_left + self.graph_outline, self.graph_area_top + self.graph_outline, width, lineHeight * len(lines) + 2)
+
+        def paint():
+            self.screen.fill(BLACK, rect)
+            for i, line in enumerate(lines):
+                draw.draw_text(self.screen, line, (rect.left + 2, rect.top + 1 + i * lineHeight), "left", font, color=YELLOW, outline=False)
+        widgets.append(('overlay', rect, lines, paint))
+
+    def _add_text(self, widgets, name, text, position, align, font, color):
+        rect = draw.text_rect(text, position, align, font, outline=False)
+        widgets.append((name, rect, (text, color), lambda: draw.draw_text(self.screen, text, position, align, font, color=color, outline=False)))
+
+    def _add_numeric_text(self, widgets, name, text, position, atlas):
+        # Centered on position, like draw_text
+        width, height = atlas.size(text)
+        rect = pygame.Rect(position[0] - width / 2, position[1], width, height)
+        widgets.append((name, rect, (text, atlas.color), lambda: atlas.draw(self.screen, text, rect.topleft)))
+
+    def draw_graph(self):
+        level = self.history.levels[self.graph_zoom]
+        hotend = (level.view('tool0'), (220, 0, 0))
+        bed = (level.view('bed'), (0, 0, 220))
+
+        # Zoomed out, each pixel also shows the range of its bucket
+        envelope = level.envelope('tool0')
+        if envelope is not None:
+            hotend += ((envelope[0], envelope[1], (110, 0, 0)),)
+
+        self.graph.draw(self.screen,
+            [ hotend, bed ],
+            [ (self.HotEndTempTarget, WHITE), (self.BedTempTarget, (40, 40, 180)) ],
+            level.count)
 
     def _home_xy(self):
         data = { "command": "home", "axes": ["x", "y"] }
@@ -684,9 +1228,34 @@ class OctoPiPanel():
 
     # Send API-data to OctoPrint
     def _sendAPICommand(self, url, data):
-        headers = { 'content-type': 'application/json', 'X-Api-Key': self.apikey }
-        r = requests.post(url, data=json.dumps(data), headers=headers)
+        if not self.Online:
+            self.command_done_error("OctoPrint is offline")
+        elif not self.commands.send(url, data):
+            self.command_done_error("Command queue full")
+
+    # A queued command got its answer from OctoPrint
+    def command_done(self, command):
+        self.stats.count('commands')
+        if self.metrics is not None:
+            self.metric_commands.observe(command.finished - command.queued)
+            if command.error is not None:
+                self.metric_commandErrors.inc()
+
+        if command.error is not None:
+            self.stats.count('command errors')
+            self.command_done_error("{0} failed: {1}".format(command.data.get('command'), command.error))
+        else:
+            self.commandError = None
+
+        # Show the effect of the command without waiting for the next poll
+        self.poller.poll_now()
+        self.pollboost_ticks = pygame.time.get_ticks() + self.pollboost
+
+    def command_done_error(self, message):
+        print message
+        self.commandError = message
+        self.commandError_ticks = pygame.time.get_ticks()
 
 if __name__ == '__main__':
-    opp = OctoPiPanel("OctoPiPanel!")
+    opp = OctoPiPanel("OctoPiPanel!", headless = '--headless' in sys.argv[1:])
     opp.Start()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Frame time benchmark.
+
+Renders the panel headless (SDL dummy video driver) from synthetic printer
+states and reports how long each drawing stage took per frame: clearing
+(fill), buttons, texts, graph and display update, plus update() and the
+whole frame. No OctoPrint is needed.
+
+Usage: python benchmark.py [-n FRAMES] [--seed SEED] [--full] [--json]
+    -n FRAMES   number of frames to render (default 1000)
+    --seed SEED random seed of the synthetic states (default 1)
+    --full      repaint the whole screen every frame, no damage tracking
+    --json      print the summary as JSON, for CI
+"""
+
+import json
+import random
+import argparse
+
+import OctoPiPanel
+from python_libs.perf import StageTimes, clock
+from python_libs.octoprint.poller import EMPTY_STATE
+
+def stage_of(name):
+    # Widget names to reported stages
+    if name.startswith('btn'):
+        return 'buttons'
+    if name.startswith('lbl'):
+        return 'text'
+    return name
+
+def states(count, seed):
+    """Yield count synthetic PrinterStates: a heating and cooling hot end,
+    jobs starting, pausing and ending, OctoPrint going offline now and
+    then."""
+    rnd = random.Random(seed)
+    state = EMPTY_STATE._replace(HotEndTemp = 21.0)
+    for frame in range(count):
+        target = state.HotEndTempTarget
+        if rnd.random() < 0.01:
+            target = rnd.choice([0.0, 190.0, 210.0, 240.0])
+        temp = state.HotEndTemp + (target - state.HotEndTemp) * 0.05 + rnd.uniform(-0.5, 0.5)
+
+        printing, paused = state.Printing, state.Paused
+        if rnd.random() < 0.02:
+            printing, paused = rnd.choice([(False, False), (True, False), (False, True)])
+
+        state = state._replace(
+            HotEndTemp = round(max(temp, 0.0), 1),
+            HotEndTempTarget = target,
+            HotHotEnd = target > 0.0,
+            Printing = printing,
+            Paused = paused,
+            JobLoaded = True,
+            Completion = (frame * 0.1) % 100,
+            PrintTimeLeft = max(0, 3600 - frame),
+            Sample = state.Sample + 1,
+            Online = rnd.random() > 0.01)
+        yield state
+
+def run(frames, seed, full):
+    panel = OctoPiPanel.OctoPiPanel("OctoPiPanel benchmark", headless = True)
+    profile = StageTimes(keep = frames, group = stage_of)
+    panel.profile = profile
+    # One graph column per state, the states come much faster than polls
+    panel.history.interval = None
+
+    for state in states(frames, seed):
+        panel.apply_state(state)
+        if full:
+            panel.damage.invalidate()
+
+        started = clock()
+        panel.update()
+        updated = clock()
+        panel.draw()
+        drawn = clock()
+
+        profile.add('update', updated - started)
+        profile.add('frame', drawn - started)
+        profile.end_frame()
+
+    return panel, profile
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "OctoPiPanel frame time benchmark")
+    parser.add_argument('-n', dest = 'frames', type = int, default = 1000, help = "number of frames")
+    parser.add_argument('--seed', type = int, default = 1, help = "random seed of the synthetic states")
+    parser.add_argument('--full', action = 'store_true', help = "repaint the whole screen every frame")
+    parser.add_argument('--json', action = 'store_true', help = "print the summary as JSON")
+    args = parser.parse_args()
+
+    panel, profile = run(args.frames, args.seed, args.full)
+    mismatches = panel.check_formats()
+    if args.json:
+        summary = profile.summary()
+        summary['formatMismatches'] = len(mismatches)
+        print json.dumps(summary, indent = 2, sort_keys = True)
+    else:
+        print "{0} frames".format(profile.frames)
+        print profile.report()
+        print "{0} cached surfaces not in display format".format(len(mismatches))
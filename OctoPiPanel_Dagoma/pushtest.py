@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""
+Push updates check against a fake OctoPrint.
+
+Starts a local fake OctoPrint serving SockJS' xhr_streaming transport
+(open frame, 'history', 'current' messages, close frame), the passive
+login and the polled REST endpoints. A headless OctoPiPanel pointed at
+it runs its own poller and push listener, so the checks go through
+get_state and get_push_state: how pushed and polled replies are merged
+into the state, the history backfill, the fallback to polling while the
+stream is down, and the circuit breaker taking the panel offline and
+back online. Each check prints OK or FAILED, the exit status is the
+number of failures. No OctoPrint, display or network access needed.
+
+Usage: python pushtest.py [-v]
+    -v          print every request the fake OctoPrint gets
+"""
+
+import json
+import time
+import argparse
+import threading
+import BaseHTTPServer
+from SocketServer import ThreadingMixIn
+
+import OctoPiPanel
+from python_libs.octoprint.breaker import CLOSED
+
+class FakeOctoPrint(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _FakeHandler)
+        self.verbose = verbose
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+        self.lock = threading.Lock()
+        self.requests = [] # (method, path)
+
+        # What the next SockJS sessions get:
+        #   'stream'    open, history, then 'current' every 0.1s until ended
+        #   'close'     open, history, one current, then a close frame
+        #   'reset'     open, history, then the connection just ends
+        #   'silent'    open, history, then nothing but the connection stays
+        #   'refuse'    404, as if there was no push API
+        self.mode = 'stream'
+        self.sessions = 0
+        self.drop = threading.Event() # set to end the sessions under way
+
+        # False makes every GET answer 503, like a proxy in front of a
+        # stopped OctoPrint. Logins and the push stream still work.
+        self.rest = True
+
+    def log(self, method, path):
+        with self.lock:
+            self.requests.append((method, path))
+        if self.verbose:
+            print "  fake: {0} {1}".format(method, path)
+
+    def count(self, method, fragment):
+        with self.lock:
+            return sum(1 for m, path in self.requests if m == method and fragment in path)
+
+    def end_streams(self):
+        """End the sessions under way, the next ones get the current mode."""
+        with self.lock:
+            self.drop.set()
+            self.drop = threading.Event()
+
+def _message(key, payload):
+    return 'a' + json.dumps([json.dumps({ key: payload })]) + '\n'
+
+def _current(temperature):
+    return _message('current', {
+        'temps': [{ 'time': time.time(), 'tool0': { 'actual': temperature, 'target': 210.0 } }],
+        'state': { 'text': 'Printing' },
+        'progress': { 'completion': 12.5, 'printTimeLeft': 600 },
+        'job': { 'file': { 'name': 'pushed.gcode' } } })
+
+def _history(first, second):
+    return [
+        { 'time': time.time() - 4, 'tool0': { 'actual': first, 'target': 210.0 } },
+        { 'time': time.time() - 2, 'tool0': { 'actual': second, 'target': 210.0 } }]
+
+class _FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Chunked HTTP/1.1 like OctoPrint's Tornado, so every frame is read
+    # as soon as it's written
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, data, status=200):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.log('GET', self.path)
+        path = self.path.split('?')[0]
+        if not self.server.rest:
+            self._json({}, 503)
+        elif path == '/api/printer':
+            temperature = { 'tool0': { 'actual': 150.0, 'target': 210.0 } }
+            if 'history=true' in self.path:
+                temperature['history'] = _history(90.0, 110.0)
+            self._json({ 'temperature': temperature })
+        elif path == '/api/job':
+            self._json({ 'progress': { 'completion': 10.0, 'printTimeLeft': 700 }, 'job': { 'file': { 'name': 'polled.gcode' } } })
+        elif path == '/api/connection':
+            self._json({ 'current': { 'state': 'Paused' } })
+        elif path == '/api/version':
+            self._json({ 'api': '0.1' })
+        else:
+            self._json({}, 404)
+
+    def do_POST(self):
+        self.server.log('POST', self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+
+        if self.path == '/api/login':
+            self._json({ 'name': '_api', 'session': 'fakesession' })
+        elif self.path.endswith('/xhr_send'):
+            self.send_response(204)
+            self.end_headers()
+        elif self.path.endswith('/xhr_streaming'):
+            self._stream()
+        else:
+            self._json({}, 404)
+
+    def _stream(self):
+        server = self.server
+        with server.lock:
+            mode = server.mode
+            drop = server.drop
+        if mode == 'refuse':
+            self._json({}, 404)
+            return
+
+        with server.lock:
+            server.sessions += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/javascript; charset=UTF-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = 1
+
+        try:
+            self._chunk('h' * 2048 + '\n') # SockJS prelude
+            self._chunk('o\n')
+            self._chunk(_message('history', { 'temps': _history(100.0, 120.0) }))
+
+            if mode == 'close':
+                self._chunk(_current(140.0))
+                self._chunk('c[3000,"Go away!"]\n')
+            elif mode == 'stream':
+                temperature = 130.0
+                while not drop.wait(0.1):
+                    temperature += 0.5
+                    self._chunk(_current(temperature))
+            elif mode == 'silent':
+                drop.wait(10)
+
+            if mode != 'reset':
+                self.wfile.write('0\r\n\r\n')
+            # 'reset' drops the connection without the last chunk
+        except IOError:
+            # The listener went away
+            pass
+
+    def _chunk(self, data):
+        self.wfile.write('{0:x}\r\n{1}\r\n'.format(len(data), data))
+        self.wfile.flush()
+
+def panel_class(url):
+    """Return an OctoPiPanel class using OctoPrint at url, with pushes on
+    and short intervals, whatever OctoPiPanel.cfg says."""
+    class Panel(OctoPiPanel.OctoPiPanel):
+        api_baseurl = url
+        pushupdates = True
+        updatetime = 100 # poll interval and first backoff
+        offlineretrymax = 800
+        apitimeout = 2000
+        staterequired = []
+        temperaturelog = ''
+        framebuffer = ''
+        metricsport = 0
+
+    for name in dir(OctoPiPanel.OctoPiPanel):
+        if name.startswith('apiurl_'):
+            setattr(Panel, name, getattr(OctoPiPanel.OctoPiPanel, name).replace(OctoPiPanel.OctoPiPanel.api_baseurl, url, 1))
+    return Panel
+
+def wait_for(condition, timeout):
+    """Return True as soon as condition() is, False after timeout seconds."""
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+class Check(object):
+    def __init__(self, verbose=False):
+        self.fake = FakeOctoPrint(verbose)
+        threading.Thread(target=self.fake.serve_forever, name="FakeOctoPrint").start()
+
+        self.panel = panel_class(self.fake.url)("OctoPiPanel push test", headless = True)
+        self.listener = self.panel.push
+        self.listener.retrydelay = 0.3
+        self.listener.timeout = 1.0
+
+        # Every message the listener passes to the panel, in arrival order
+        self.messages = []
+        on_push = self.panel.on_push
+        def record(key, payload):
+            self.messages.append(key)
+            on_push(key, payload)
+        self.listener.on_message = record
+
+        # The temperatures of every backfill published, in order. Polls
+        # and pushes race when the stream drops, the last one may win.
+        self.backfills = []
+        notify = self.panel.poller.notify
+        def published():
+            backfill = self.state().Backfill
+            if backfill and backfill is not self.lastBackfill:
+                self.lastBackfill = backfill
+                self.backfills.append([values['tool0'] for timestamp, values in backfill])
+            notify()
+        self.lastBackfill = None
+        self.panel.poller.notify = published
+
+        self.failures = 0
+
+    def state(self):
+        return self.panel.poller.latest()[1]
+
+    def polls(self):
+        return self.fake.count('GET', '/api/printer')
+
+    def quiet(self, seconds):
+        """Return True if no poll is made for seconds, after the one under
+        way, if any, is done."""
+        time.sleep(0.3)
+        polls = self.polls()
+        time.sleep(seconds)
+        return self.polls() == polls
+
+    def expect(self, name, ok, detail=''):
+        print "{0:<8} {1}{2}".format("OK" if ok else "FAILED", name, " ({0})".format(detail) if detail and not ok else "")
+        if not ok:
+            self.failures += 1
+
+    def run(self):
+        fake = self.fake
+        panel = self.panel
+        self.listener.start()
+
+        # Open, passive login, history first, then current messages. The
+        # poller starts once the stream is open, it mustn't poll then.
+        self.expect("push session opens", wait_for(lambda: self.listener.connected, 3))
+        panel.poller.start()
+        self.expect("passive login and auth sent", wait_for(lambda: fake.count('POST', '/api/login') and fake.count('POST', '/xhr_send'), 3))
+        self.expect("history arrives before current", wait_for(lambda: 'current' in self.messages, 3) and self.messages[0] == 'history', self.messages[:3])
+        self.expect("pushed history backfills the graph", wait_for(lambda: [100.0, 120.0] in self.backfills, 3), self.backfills)
+        self.expect("pushed temperatures are merged", wait_for(lambda: self.state().HotEndTemp > 130.0 and self.state().HotEndTempTarget == 210.0 and self.state().HotHotEnd, 3), self.state())
+        state = self.state()
+        self.expect("pushed job and state are merged", (state.Printing, state.Paused, state.JobLoaded, state.Completion, state.PrintTimeLeft, state.FileName) == (True, False, True, 12.5, 600, 'pushed.gcode'), state)
+        samples = self.state().Sample
+        self.expect("pushes add graph samples", wait_for(lambda: self.state().Sample >= samples + 3, 3))
+        self.expect("no polls while the stream is open", self.quiet(0.5))
+
+        # Close frame: reconnect, history again
+        fake.mode = 'close'
+        sessions = fake.sessions
+        histories = self.messages.count('history')
+        fake.end_streams()
+        self.expect("reconnects after a close frame", wait_for(lambda: fake.sessions >= sessions + 2, 5), "{0} sessions".format(fake.sessions - sessions))
+        self.expect("history again after reconnecting", wait_for(lambda: self.messages.count('history') >= histories + 2, 3))
+
+        # Connection ended without a close frame
+        fake.mode = 'reset'
+        sessions = fake.sessions
+        self.expect("reconnects after the stream ends", wait_for(lambda: fake.sessions >= sessions + 2, 5))
+
+        # No push API at all: polling takes over
+        fake.mode = 'refuse'
+        polls = self.polls()
+        self.expect("stream down without a push API", wait_for(lambda: not self.listener.connected, 3))
+        self.expect("polling takes over", wait_for(lambda: self.polls() >= polls + 3, 3), "{0} polls".format(self.polls() - polls))
+        self.expect("polled state is merged", wait_for(lambda: self.state().HotEndTemp == 150.0 and self.state().FileName == 'polled.gcode', 3), self.state())
+        state = self.state()
+        self.expect("polled job and state are merged", (state.Printing, state.Paused, state.Completion, state.PrintTimeLeft, state.Online) == (False, True, 10.0, 700, True), state)
+
+        # OctoPrint answers errors only: offline, with backoff
+        fake.rest = False
+        self.expect("panel goes offline", wait_for(lambda: not self.state().Online and panel.breaker.state != CLOSED, 3), (self.state().Online, panel.breaker.state))
+        self.expect("probes back off", wait_for(lambda: panel.breaker.delay >= 4 * panel.breaker.backoff, 3), panel.breaker.delay)
+
+        # Pushes get through while the REST API still fails: back online
+        fake.mode = 'stream'
+        self.expect("a push brings the panel back online", wait_for(lambda: self.state().Online and panel.breaker.state == CLOSED, 5), (self.state().Online, panel.breaker.state))
+        self.expect("no polls while pushes flow", self.quiet(0.5))
+
+        # A stream that goes quiet hits the read timeout, polling resumes
+        fake.rest = True
+        fake.mode = 'silent'
+        sessions = fake.sessions
+        backfills = len(self.backfills)
+        fake.end_streams()
+        self.expect("push reconnects", wait_for(lambda: fake.sessions > sessions and self.listener.connected, 3))
+        polls = self.polls()
+        self.expect("a silent stream times out", wait_for(lambda: not self.listener.connected, 4))
+        self.expect("polling resumes", wait_for(lambda: self.polls() > polls, 3))
+        self.expect("the first poll after being offline backfills the graph", wait_for(lambda: [90.0, 110.0] in self.backfills[backfills:], 3), self.backfills[backfills:])
+
+        # Pushes flow again, polls stop
+        fake.mode = 'stream'
+        fake.end_streams()
+        self.expect("push resumes", wait_for(lambda: self.listener.connected and self.messages[-1] == 'current', 5))
+        self.expect("polling stops again", self.quiet(0.5))
+
+        self.listener.stop()
+        panel.poller.stop()
+        fake.end_streams()
+        panel.client.close()
+        fake.shutdown()
+        fake.server_close()
+        return self.failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Push updates check against a fake OctoPrint")
+    parser.add_argument('-v', dest = 'verbose', action = 'store_true', help = "print the requests of the fake OctoPrint")
+    args = parser.parse_args()
+
+    failures = Check(args.verbose).run()
+    print "{0} failed".format(failures) if failures else "all passed"
+    raise SystemExit(failures)
@@ -37,6 +37,7 @@ or implied, of Al Sweigart.
 """
 import pygame
 from pygame.locals import *
+from collections import OrderedDict
 
 pygame.font.init()
 PYGBUTTON_FONT = pygame.font.Font('freesansbold.ttf', 14)
@@ -47,6 +48,80 @@ DARKGRAY  = ( 64,  64,  64)
 GRAY      = (128, 128, 128)
 LIGHTGRAY = (212, 208, 200)
 
+CAPTIONS_CACHED = 32 # rendered captions kept, see _getCaption()
+_captions = OrderedDict() # (font, caption, fgcolor, bgcolor) -> surface
+
+SKIN_KEY = (255, 0, 255) # colour key of the bevel overlays, never drawn
+_skins = {} # (size, bgcolor, border style) -> skin, see _getSkin()
+
+def _getSkin(size, bgcolor, style='bevel'):
+    """Return (background, normal border, down border) surfaces for text
+    buttons of this size and background color. They are built once and
+    shared by all buttons: blit the background, the caption, then a
+    border over them."""
+    key = (tuple(size), tuple(bgcolor), style)
+    skin = _skins.get(key)
+    if skin is not None:
+        return skin
+
+    w, h = size
+
+    background = pygame.Surface(size)
+    background.fill(bgcolor)
+
+    # draw border for normal button
+    borderNormal = pygame.Surface(size)
+    borderNormal.fill(SKIN_KEY)
+    pygame.draw.rect(borderNormal, BLACK, pygame.Rect((0, 0, w, h)), 1) # black border around everything
+    pygame.draw.line(borderNormal, WHITE, (1, 1), (w - 2, 1))
+    pygame.draw.line(borderNormal, WHITE, (1, 1), (1, h - 2))
+    pygame.draw.line(borderNormal, DARKGRAY, (1, h - 1), (w - 1, h - 1))
+    pygame.draw.line(borderNormal, DARKGRAY, (w - 1, 1), (w - 1, h - 1))
+    pygame.draw.line(borderNormal, GRAY, (2, h - 2), (w - 2, h - 2))
+    pygame.draw.line(borderNormal, GRAY, (w - 2, 2), (w - 2, h - 2))
+
+    # draw border for down button
+    borderDown = pygame.Surface(size)
+    borderDown.fill(SKIN_KEY)
+    pygame.draw.rect(borderDown, BLACK, pygame.Rect((0, 0, w, h)), 1) # black border around everything
+    pygame.draw.line(borderDown, WHITE, (1, 1), (w - 2, 1))
+    pygame.draw.line(borderDown, WHITE, (1, 1), (1, h - 2))
+    pygame.draw.line(borderDown, DARKGRAY, (1, h - 2), (1, 1))
+    pygame.draw.line(borderDown, DARKGRAY, (1, 1), (w - 2, 1))
+    pygame.draw.line(borderDown, GRAY, (2, h - 3), (2, 2))
+    pygame.draw.line(borderDown, GRAY, (2, 2), (w - 3, 2))
+
+    borderNormal.set_colorkey(SKIN_KEY, RLEACCEL)
+    borderDown.set_colorkey(SKIN_KEY, RLEACCEL)
+
+    skin = (background, borderNormal, borderDown)
+    _skins[key] = skin
+    return skin
+
+def _getCaption(font, caption, fgcolor, bgcolor):
+    """Return the caption rendered on the button background. Captions are
+    shared by all buttons, the CAPTIONS_CACHED last used are kept."""
+    key = (font, caption, tuple(fgcolor), tuple(bgcolor))
+    surface = _captions.pop(key, None)
+    if surface is None:
+        surface = font.render(caption, True, fgcolor, bgcolor)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert() # blitted at every draw
+        if len(_captions) >= CAPTIONS_CACHED:
+            _captions.popitem(last=False) # least recently used
+    _captions[key] = surface
+    return surface
+
+def surfaces():
+    """Return (name, surface) of the skins and captions made."""
+    result = []
+    for (size, bgcolor, style), skin in _skins.items():
+        name = "button skin {0}x{1} {2}".format(size[0], size[1], bgcolor)
+        result += [(name, skin[0]), (name + " normal", skin[1]), (name + " down", skin[2])]
+    for (font, caption, fgcolor, bgcolor), surface in _captions.items():
+        result.append(("button caption {0!r}".format(caption), surface))
+    return result
+
 class PygButton(object):
     def __init__(self, rect=None, caption='', bgcolor=LIGHTGRAY, fgcolor=BLACK, font=None, normal=None, down=None, highlight=None):
         """Create a new button object. Parameters:
@@ -98,9 +173,6 @@ class PygButton(object):
 
         if normal is None:
             # create the surfaces for a text button
-            self.surfaceNormal = pygame.Surface(self._rect.size)
-            self.surfaceDown = pygame.Surface(self._rect.size)
-            self.surfaceHighlight = pygame.Surface(self._rect.size)
             self._update() # draw the initial button images
         else:
             # create the surfaces for a custom image button
@@ -181,7 +253,14 @@ class PygButton(object):
 
     def draw(self, surfaceObj):
         """Blit the current button's appearance to the surface object."""
-        if self._visible:
+        if self._visible and not self.customSurfaces:
+            # text buttons are put together from the shared surfaces
+            background, borderNormal, borderDown = self._skin
+            surfaceObj.blit(background, self._rect)
+            surfaceObj.blit(self._captionSurf, self._captionRect.move(self._rect.topleft), self._captionArea)
+            # the bevels go over the caption, highlighted looks normal
+            surfaceObj.blit(borderDown if self.buttonDown else borderNormal, self._rect)
+        elif self._visible:
             if self.buttonDown:
                 surfaceObj.blit(self.surfaceDown, self._rect)
             elif self.mouseOverButton:
@@ -201,38 +280,18 @@ class PygButton(object):
         w = self._rect.width # syntactic sugar
         h = self._rect.height # syntactic sugar
 
-        # fill background color for all buttons
-        self.surfaceNormal.fill(self.bgcolor)
-        self.surfaceDown.fill(self.bgcolor)
-        self.surfaceHighlight.fill(self.bgcolor)
+        # A text button owns no surface, draw() blits the background and
+        # bevels shared with every button of this size and color, and the
+        # caption shared with every button showing it
+        self.surfaceNormal = self.surfaceDown = self.surfaceHighlight = None
+        self._skin = _getSkin(self._rect.size, self.bgcolor)
+        self._captionSurf = _getCaption(self._font, self._caption, self.fgcolor, self.bgcolor)
 
-        # draw caption text for all buttons
-        captionSurf = self._font.render(self._caption, True, self.fgcolor, self.bgcolor)
-        captionRect = captionSurf.get_rect()
+        # centered, the part off the button is never drawn
+        captionRect = self._captionSurf.get_rect()
         captionRect.center = int(w / 2), int(h / 2)
-        self.surfaceNormal.blit(captionSurf, captionRect)
-        self.surfaceDown.blit(captionSurf, captionRect)
-
-        # draw border for normal button
-        pygame.draw.rect(self.surfaceNormal, BLACK, pygame.Rect((0, 0, w, h)), 1) # black border around everything
-        pygame.draw.line(self.surfaceNormal, WHITE, (1, 1), (w - 2, 1))
-        pygame.draw.line(self.surfaceNormal, WHITE, (1, 1), (1, h - 2))
-        pygame.draw.line(self.surfaceNormal, DARKGRAY, (1, h - 1), (w - 1, h - 1))
-        pygame.draw.line(self.surfaceNormal, DARKGRAY, (w - 1, 1), (w - 1, h - 1))
-        pygame.draw.line(self.surfaceNormal, GRAY, (2, h - 2), (w - 2, h - 2))
-        pygame.draw.line(self.surfaceNormal, GRAY, (w - 2, 2), (w - 2, h - 2))
-
-        # draw border for down button
-        pygame.draw.rect(self.surfaceDown, BLACK, pygame.Rect((0, 0, w, h)), 1) # black border around everything
-        pygame.draw.line(self.surfaceDown, WHITE, (1, 1), (w - 2, 1))
-        pygame.draw.line(self.surfaceDown, WHITE, (1, 1), (1, h - 2))
-        pygame.draw.line(self.surfaceDown, DARKGRAY, (1, h - 2), (1, 1))
-        pygame.draw.line(self.surfaceDown, DARKGRAY, (1, 1), (w - 2, 1))
-        pygame.draw.line(self.surfaceDown, GRAY, (2, h - 3), (2, 2))
-        pygame.draw.line(self.surfaceDown, GRAY, (2, 2), (w - 3, 2))
-
-        # draw border for highlight button
-        self.surfaceHighlight = self.surfaceNormal
+        self._captionRect = captionRect.clip(pygame.Rect(0, 0, w, h))
+        self._captionArea = self._captionRect.move(-captionRect.left, -captionRect.top)
 
 
     def mouseClick(self, event):
@@ -282,6 +341,8 @@ class PygButton(object):
 
 
     def _propSetCaption(self, captionText):
+        if captionText == self._caption and not self.customSurfaces:
+            return # nothing changes, don't redraw
         self.customSurfaces = False
         self._caption = captionText
         self._update()
@@ -310,6 +371,8 @@ class PygButton(object):
 
 
     def _propSetFgColor(self, setting):
+        if setting == self._fgcolor and not self.customSurfaces:
+            return
         self.customSurfaces = False
         self._fgcolor = setting
         self._update()
@@ -320,6 +383,8 @@ class PygButton(object):
 
 
     def _propSetBgColor(self, setting):
+        if setting == self._bgcolor and not self.customSurfaces:
+            return
         self.customSurfaces = False
         self._bgcolor = setting
         self._update()
@@ -330,6 +395,8 @@ class PygButton(object):
 
 
     def _propSetFont(self, setting):
+        if setting is self._font and not self.customSurfaces:
+            return
         self.customSurfaces = False
         self._font = setting
         self._update()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Display format assets.
+
+Blitting a surface whose pixel format differs from the screen's makes
+SDL convert every pixel of it on every blit, e.g. the 32 bpp surfaces
+font.render and image.load return onto the 16 bpp TFT. Surfaces that
+are kept around are therefore converted once, when they are made:
+display_format() converts opaque and colour keyed surfaces to the
+screen's format and surfaces with per pixel alpha with convert_alpha().
+
+AssetManager loads the icons and fonts, once each, and check() tells
+which surfaces still aren't in the display format.
+"""
+
+import os
+import pygame
+
+def display_format(surface):
+    """Return surface converted for fast blits to the screen, or surface
+    itself if there is no screen yet."""
+    if pygame.display.get_surface() is None:
+        return surface
+
+    if surface.get_flags() & pygame.SRCALPHA:
+        return surface.convert_alpha()
+
+    colorkey = surface.get_colorkey()
+    converted = surface.convert()
+    if colorkey is not None:
+        converted.set_colorkey(colorkey, pygame.RLEACCEL)
+    return converted
+
+# The format convert_alpha gives, per screen format
+_alphaFormats = {}
+
+def matches_display(surface):
+    """Return True if surface blits to the screen without a conversion."""
+    screen = pygame.display.get_surface()
+    if screen is None:
+        return True
+
+    if surface.get_flags() & pygame.SRCALPHA:
+        key = (screen.get_bitsize(), screen.get_masks())
+        alpha = _alphaFormats.get(key)
+        if alpha is None:
+            sample = pygame.Surface((1, 1), pygame.SRCALPHA, 32).convert_alpha()
+            alpha = (sample.get_bitsize(), sample.get_masks())
+            _alphaFormats[key] = alpha
+        return (surface.get_bitsize(), surface.get_masks()) == alpha
+
+    return surface.get_bitsize() == screen.get_bitsize() and surface.get_masks() == screen.get_masks()
+
+def describe(surface):
+    """Return the pixel format of surface as text."""
+    alpha = " with alpha" if surface.get_flags() & pygame.SRCALPHA else ""
+    return "{0} bpp{1}, masks {2}".format(surface.get_bitsize(), alpha, ", ".join("{0:08x}".format(mask & 0xFFFFFFFF) for mask in surface.get_masks()))
+
+class AssetManager(object):
+    def __init__(self, directory):
+        """Create an asset manager loading files relative to directory."""
+        self.directory = directory
+        self._images = {}
+        self._fonts = {}
+
+    def _path(self, filename):
+        # Config values may come quoted
+        return os.path.join(self.directory, filename.strip().strip('"\''))
+
+    def image(self, filename):
+        """Return the image in filename in display format, loaded on the
+        first call only. Return None if it can't be loaded."""
+        path = self._path(filename)
+        if path not in self._images:
+            try:
+                self._images[path] = display_format(pygame.image.load(path))
+            except pygame.error as e:
+                print "Can't load image {0}: {1}".format(path, e)
+                self._images[path] = None
+        return self._images[path]
+
+    def font(self, filename, size, bold=False):
+        """Return the font in filename at size, loaded on the first call
+        only, or pygame's default font if there is no such file. Fonts
+        are shared, don't change their style."""
+        key = (self._path(filename), size, bold)
+        font = self._fonts.get(key)
+        if font is None:
+            if os.path.isfile(key[0]):
+                font = pygame.font.Font(key[0], size)
+            else:
+                print "Font {0} not found, using pygame's default font".format(key[0])
+                font = pygame.font.Font(None, size)
+            font.set_bold(bold)
+            self._fonts[key] = font
+        return font
+
+    def check(self, surfaces=()):
+        """Return (name, format) of the loaded images and of the (name,
+        surface) pairs in surfaces that aren't in display format."""
+        mismatches = []
+        named = [(os.path.relpath(path, self.directory), image) for path, image in sorted(self._images.items())]
+        for name, surface in named + list(surfaces):
+            if surface is not None and not matches_display(surface):
+                mismatches.append((name, describe(surface)))
+        return mismatches
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Damage tracking for partial screen updates.
+
+Every frame the caller describes its widgets as (name, rect, key, paint)
+tuples, in drawing order. key is anything comparable that changes when
+the widget looks different (caption, value, state...). Only the areas of
+widgets whose rect or key changed are cleared and repainted, clipped, by
+every widget overlapping them, and only those areas are returned for
+pygame.display.update.
+"""
+
+import pygame
+from python_libs.perf import clock
+
+class DamageTracker(object):
+    def __init__(self):
+        self._last = {} # name -> (rect, key) as of the last frame
+        self._full = True
+
+    def invalidate(self):
+        """Repaint the whole surface on the next frame."""
+        self._full = True
+
+    def damage(self, widgets):
+        """Return the list of rects that changed since the last frame."""
+        dirty = []
+        current = {}
+
+        for name, rect, key, paint in widgets:
+            current[name] = (rect, key)
+            last = self._last.get(name)
+            if last is None or last[0] != rect or last[1] != key:
+                if last is not None:
+                    dirty.append(last[0])
+                dirty.append(rect)
+
+        # Widgets that are gone leave their old area behind
+        for name in self._last:
+            if name not in current:
+                dirty.append(self._last[name][0])
+
+        self._last = current
+        return merge_rects(dirty)
+
+    def repaint(self, surface, widgets, bgcolor, profile=None):
+        """Repaint the changed areas of surface, return them. If profile
+        (a StageTimes) is given, the time spent clearing is added to its
+        'fill' stage and each widget's paint time to the widget's name."""
+        if self._full:
+            self._full = False
+            self.damage(widgets)
+            dirty = [surface.get_rect()]
+        else:
+            dirty = self.damage(widgets)
+
+        clip = surface.get_clip()
+        for area in dirty:
+            surface.set_clip(area)
+            if profile is None:
+                surface.fill(bgcolor, area)
+                for name, rect, key, paint in widgets:
+                    if rect.colliderect(area):
+                        paint()
+            else:
+                started = clock()
+                surface.fill(bgcolor, area)
+                profile.add('fill', clock() - started)
+                for name, rect, key, paint in widgets:
+                    if rect.colliderect(area):
+                        started = clock()
+                        paint()
+                        profile.add(name, clock() - started)
+        surface.set_clip(clip)
+
+        return dirty
+
+def merge_rects(rects):
+    """Merge overlapping rects so no area is repainted twice."""
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        if rect.width <= 0 or rect.height <= 0:
+            continue
+        # Merging can make a rect overlap one checked earlier, start over then
+        i = 0
+        while i < len(merged):
+            if merged[i].colliderect(rect):
+                rect.union_ip(merged.pop(i))
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+Routes pygame events to PygButtons.
+
+Handing every event to every button's handleEvent makes each button do
+its rect tests for each of the MOUSEMOTION events a touchscreen floods
+in. The dispatcher indexes the visible buttons in a uniform grid and
+hands a pointer event only to the buttons under the pointer, plus those
+still holding state from earlier events (hovered, pressed or waiting for
+the mouse up). Those must see the event to send 'exit' or drop the
+press, exactly as if every button had been given the event. Other
+events never reach the buttons.
+"""
+
+import pygame
+
+POINTER_EVENTS = (pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)
+
+class ButtonDispatcher(object):
+    def __init__(self, cellsize=40):
+        """Create an empty dispatcher. Parameters:
+            cellsize - side of the grid cells, in pixels
+            """
+        self.cellsize = cellsize
+        self._buttons = [] # (button, onclick) in the order they were added
+        self._layout = None
+        self._grid = {}
+        self._active = set() # indexes of the buttons with pending state
+
+    def add(self, button, onclick):
+        """Route the events of button, call onclick() when it's clicked."""
+        self._buttons.append((button, onclick))
+        self._layout = None
+
+    def buttons(self):
+        """Return the buttons, in the order they were added."""
+        return [button for button, onclick in self._buttons]
+
+    def refresh(self):
+        """Re-index the buttons if one moved, was resized, shown or hidden.
+        Call it once before each batch of events."""
+        layout = [(tuple(button.rect), button.visible) for button, onclick in self._buttons]
+        if layout == self._layout:
+            return
+        self._layout = layout
+
+        size = self.cellsize
+        self._grid = {}
+        for i, (button, onclick) in enumerate(self._buttons):
+            if not button.visible:
+                continue
+            rect = button.rect
+            if rect.width <= 0 or rect.height <= 0:
+                continue
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                    self._grid.setdefault((cx, cy), []).append(i)
+
+    def hit(self, pos):
+        """Return the indexes of the visible buttons under pos."""
+        cell = self._grid.get((pos[0] // self.cellsize, pos[1] // self.cellsize), ())
+        return [i for i in cell if self._buttons[i][0].rect.collidepoint(pos)]
+
+    def dispatch(self, event):
+        """Hand event to the buttons concerned, call the onclick of the
+        clicked ones. Return the number of buttons that got the event."""
+        if event.type not in POINTER_EVENTS:
+            return 0
+        if self._layout is None:
+            self.refresh()
+
+        targets = sorted(self._active.union(self.hit(event.pos)))
+        for i in targets:
+            button, onclick = self._buttons[i]
+            if 'click' in button.handleEvent(event):
+                onclick()
+
+            if button.mouseOverButton or button.buttonDown or button.lastMouseDownOverButton:
+                self._active.add(i)
+            else:
+                self._active.discard(i)
+
+        return len(targets)
@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 
-import python_libs.draw.hollowtext as hollowtext
+import python_libs.draw.textcache as textcache
 import pygame
 
 def draw_text(surface, text, position, align="none", font="", color=(0, 255, 0), outline=True, outline_color=(1, 1, 1)):	
-	label = font.render(text, 1, color)
+	label = textcache.render(font, text, color)
 	if position[0] == "right":
 		x = screensize[0]
 	elif position[0] == "left":
@@ -25,11 +25,24 @@ def draw_text(surface, text, position, align="none", font="", color=(0, 255, 0),
 		x = x-(label.get_width()/2)		
 	pos = (x, y)
 	if outline == True:
-		text = hollowtext.textOutline(font, text, color, outline_color)
+		text = textcache.render(font, text, color, True, outline_color)
 		surface.blit( text, (pos[0], pos[1]))
 	else:
 		surface.blit( label, (pos[0], pos[1]))
 
+def text_rect(text, position, align="none", font="", outline=True):
+	# Where draw_text will blit text, without rendering it
+	width, height = font.size(text)
+	if outline == True:
+		width, height = width + 2, height + 2
+	x = position[0]
+	y = position[1]
+	if align == "right":
+		x = x-width
+	elif align == "center":
+		x = x-(width/2)
+	return pygame.Rect(x, y, width, height)
+
 def draw_image(surface, img, position, align="none"):
 	x = position[0]
 	y = position[1]
@@ -47,12 +60,12 @@ def draw_button(surface, img, position, text="none", font="none", color=(0, 255,
 	elif align == "center":
 		x = x-(img.get_width()/2)
 	if text != "none":
-		label = font.render(text, 1, color)
+		label = textcache.render(font, text, color)
 		label_position = ( x+(img.get_width()/2)-(label.get_width()/2), y+(img.get_height()/2)-(font.get_height()/2) )
 	surface.blit(img, (x, y))
 	
 	if outline == True:
-		text = hollowtext.textOutline(font, text, color, outline_color)
+		text = textcache.render(font, text, color, True, outline_color)
 		surface.blit( text, label_position)
 	else:
 		surface.blit( label, label_position)
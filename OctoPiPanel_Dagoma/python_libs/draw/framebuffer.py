@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+Direct framebuffer output.
+
+Instead of pygame.display.update, which makes SDL convert the whole
+screen for the framebuffer driver, the panel can map the framebuffer
+device (mmap) and write only the dirty rects into it, converted to
+RGB565 with NumPy. Any regular file can stand in for the device: the
+geometry is then the one given to the constructor.
+
+Needs NumPy (and pygame.surfarray), see available().
+"""
+
+import os
+import mmap
+import fcntl
+import struct
+
+import pygame
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# linux/fb.h
+FBIOGET_VSCREENINFO = 0x4600
+FBIOGET_FSCREENINFO = 0x4602
+FB_VAR_SCREENINFO = struct.Struct('8I')     # xres, yres, xres_virtual, yres_virtual, xoffset, yoffset, bits_per_pixel, grayscale
+FB_FIX_SCREENINFO = struct.Struct('16sLIIIIHHHIL') # id, smem_start, smem_len, type, type_aux, visual, xpanstep, ypanstep, ywrapstep, line_length, mmio_start
+
+def available():
+    """Return True if NumPy is there to do the conversion."""
+    return numpy is not None
+
+class FramebufferOutput(object):
+    def __init__(self, path, size):
+        """Map the framebuffer at path. Parameters:
+            path - framebuffer device, e.g. /dev/fb1, or a regular file.
+            size - (width, height) of the screen surface. A device must
+                be at least that big and 16 bits per pixel. A regular
+                file is taken as a 16 bpp framebuffer of that size, and
+                extended if it is shorter.
+            """
+        if numpy is None:
+            raise RuntimeError("the framebuffer output needs NumPy")
+
+        self.path = path
+        self._file = open(path, 'r+b')
+
+        width, height, bpp, stride = self._geometry(size)
+        if bpp != 16:
+            self._file.close()
+            raise RuntimeError("{0} is {1} bits per pixel, only 16 is supported".format(path, bpp))
+        if width < size[0] or height < size[1]:
+            self._file.close()
+            raise RuntimeError("{0} is {1}x{2}, smaller than the screen".format(path, width, height))
+
+        self.width = width
+        self.height = height
+        self.stride = stride
+
+        length = stride * height
+        if os.path.isfile(path) and os.fstat(self._file.fileno()).st_size < length:
+            self._file.truncate(length)
+
+        self._map = mmap.mmap(self._file.fileno(), length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        # The mapped memory itself as rows of pixels, slices write straight into it
+        self._pixels = numpy.ndarray((height, stride // 2), dtype='<u2', buffer=self._map)
+
+    def _geometry(self, size):
+        # Return (width, height, bits per pixel, bytes per row)
+        try:
+            var = FB_VAR_SCREENINFO.unpack(fcntl.ioctl(self._file, FBIOGET_VSCREENINFO, '\0' * 160)[:FB_VAR_SCREENINFO.size])
+            fix = FB_FIX_SCREENINFO.unpack(fcntl.ioctl(self._file, FBIOGET_FSCREENINFO, '\0' * 80)[:FB_FIX_SCREENINFO.size])
+            return var[0], var[1], var[6], fix[9]
+        except IOError:
+            # Not a framebuffer device
+            return size[0], size[1], 16, size[0] * 2
+
+    def update(self, surface, rects=None):
+        """Copy the rects (default: all) of surface to the framebuffer."""
+        bounds = surface.get_rect().clip(pygame.Rect(0, 0, self.width, self.height))
+        if rects is None:
+            rects = [bounds]
+
+        for rect in rects:
+            rect = bounds.clip(rect)
+            if rect.width <= 0 or rect.height <= 0:
+                continue
+
+            if surface.get_bitsize() in (24, 32):
+                # A view of the surface pixels, no copy
+                rgb = pygame.surfarray.pixels3d(surface)[rect.left:rect.right, rect.top:rect.bottom]
+            else:
+                rgb = pygame.surfarray.array3d(surface.subsurface(rect))
+
+            r = rgb[:, :, 0].astype(numpy.uint16)
+            g = rgb[:, :, 1].astype(numpy.uint16)
+            b = rgb[:, :, 2].astype(numpy.uint16)
+            del rgb # unlocks the surface
+
+            # surfarray is indexed [x, y], the framebuffer [y, x]
+            self._pixels[rect.top:rect.bottom, rect.left:rect.right] = (((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)).T
+
+    def close(self):
+        if self._map is None:
+            return
+        self._pixels = None
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.close()
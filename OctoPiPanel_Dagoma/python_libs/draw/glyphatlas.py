@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Pre-rasterised glyph atlas for numeric readouts.
+
+TTF rasterisation of a big font is slow on small boards, and the
+temperature readout only uses a handful of characters. A GlyphAtlas
+renders each of them once, for one font and colour, into a single
+surface. Strings are then drawn by blitting sub-rects of that surface.
+Characters missing from the atlas are rendered with font.render the
+first time they are seen and kept as well.
+
+Glyphs are placed where font.render puts them, pixel for pixel. Each
+glyph follows the previous one by that one's advance plus the kerning
+of the pair, both measured once and kept, so laying out a new string
+costs no font call once its pairs have been seen. The kerning is
+measured on the pair rendered alone and also takes in the bold overlap
+and glyphs reaching left of their pen position.
+"""
+
+import pygame
+from python_libs.draw.assets import display_format
+
+# Everything the temperature readout prints
+NUMERIC = u'0123456789.()- '
+
+class GlyphAtlas(object):
+    def __init__(self, font, color, charset=NUMERIC):
+        self.font = font
+        self.color = color
+
+        glyphs = [(c, font.render(c, 1, color)) for c in charset]
+        width = sum(glyph.get_width() for c, glyph in glyphs)
+        height = max(glyph.get_height() for c, glyph in glyphs)
+
+        self.atlas = pygame.Surface((max(width, 1), height), pygame.SRCALPHA, 32)
+        self.atlas.fill((0, 0, 0, 0))
+
+        self._rects = {}
+        self._sizes = {}
+        self._advances = {}
+        self._kernings = {}
+        x = 0
+        for c, glyph in glyphs:
+            # Copy the glyph pixels as they are, alpha included
+            self.atlas.blit(glyph, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self._rects[c] = pygame.Rect(x, 0, glyph.get_width(), glyph.get_height())
+            x += glyph.get_width()
+
+        self.atlas = display_format(self.atlas)
+
+        # Fallback glyphs, rendered on first use
+        self._extra = {}
+
+        # Glyph offsets of the strings drawn lately, see _layout
+        self._layouts = {}
+
+    def _glyph(self, c):
+        # Return (surface, area) of the glyph for c
+        rect = self._rects.get(c)
+        if rect is not None:
+            return self.atlas, rect
+
+        extra = self._extra.get(c)
+        if extra is None:
+            glyph = self.font.render(c, 1, self.color)
+            extra = (display_format(glyph), glyph.get_rect())
+            self._extra[c] = extra
+        return extra
+
+    def _size(self, c):
+        # (width, height) of c rendered alone
+        size = self._sizes.get(c)
+        if size is None:
+            size = self.font.size(c)
+            self._sizes[c] = size
+        return size
+
+    def _advance(self, c):
+        # How far the pen moves after c
+        advance = self._advances.get(c)
+        if advance is None:
+            metrics = self.font.metrics(c)
+            advance = metrics[0][4] if metrics and metrics[0] is not None else self._size(c)[0]
+            self._advances[c] = advance
+        return advance
+
+    def _kerning(self, pair):
+        # What the second glyph of pair is moved by on top of the advance
+        # of the first. The width of the pair ends with the second glyph
+        # as wide as alone, overhang and left reach included.
+        kerning = self._kernings.get(pair)
+        if kerning is None:
+            kerning = self.font.size(pair)[0] - self._size(pair[1])[0] - self._advance(pair[0])
+            self._kernings[pair] = kerning
+        return kerning
+
+    def _layout(self, text):
+        # Return ([x of each glyph], size) of text, as font.render lays it out
+        layout = self._layouts.get(text)
+        if layout is None:
+            if len(self._layouts) >= 64:
+                self._layouts.clear()
+            offsets = []
+            x = 0
+            for i, c in enumerate(text):
+                if i:
+                    x += self._advance(text[i - 1]) + self._kerning(text[i - 1:i + 1])
+                offsets.append(x)
+            if text:
+                size = (x + self._size(text[-1])[0], self._size(text[-1])[1])
+            else:
+                size = self.font.size(text)
+            layout = (offsets, size)
+            self._layouts[text] = layout
+        return layout
+
+    def size(self, text):
+        """Return (width, height) of text drawn with the atlas."""
+        return self._layout(text)[1]
+
+    def draw(self, surface, text, position):
+        """Draw text with its top left corner at position."""
+        x, y = position
+        offsets, size = self._layout(text)
+        for c, offset in zip(text, offsets):
+            glyph, area = self._glyph(c)
+            surface.blit(glyph, (x + offset, y), area)
+
+# One atlas per font and colour
+_atlases = {}
+
+def get_atlas(font, color):
+    key = (font, font.get_bold(), font.get_italic(), tuple(color))
+    atlas = _atlases.get(key)
+    if atlas is None:
+        atlas = GlyphAtlas(font, color)
+        _atlases[key] = atlas
+    return atlas
+
+def surfaces():
+    """Return (name, surface) of the atlases and fallback glyphs made."""
+    result = []
+    for atlas in _atlases.values():
+        name = "glyph atlas {0}".format(atlas.color)
+        result.append((name, atlas.atlas))
+        for c, (glyph, area) in atlas._extra.items():
+            result.append(("{0} {1!r}".format(name, c), glyph))
+    return result
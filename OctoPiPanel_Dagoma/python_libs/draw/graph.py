@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+Temperature graph.
+
+The axes, scale labels, grid lines and rounded outline never change
+between frames. They are drawn once into display format surfaces, a
+background layer and an outline overlay, and rebuilt only when the
+geometry or colours change.
+
+The curves live on their own colour-keyed plot surface. When samples are
+added it is scrolled left (Surface.scroll) and only the new columns are
+painted, so a new sample costs the same whatever the graph width. A
+frame is then three blits, background, plot and outline, plus the
+target lines.
+"""
+
+import pygame
+import python_libs.draw.drawfunctions as draw
+
+BLACK = (  0,   0,   0)
+WHITE = (255, 255, 255)
+GRAY =  (160, 160, 160)
+LABELGRAY = (200, 200, 200)
+
+# Colour key of the outline overlay, never drawn
+OVERLAY_KEY = (255, 0, 255)
+
+class TemperatureGraph(object):
+    def __init__(self, left, top, width, height, font, outline=2, maxtemp=250, bgcolor=BLACK, gridcolor=GRAY, labelcolor=LABELGRAY, outlinecolor=WHITE):
+        """Create a graph plotting 0 to maxtemp degrees in the area
+        (left, top, width, height). The scale labels are rendered with font
+        left of the area."""
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.font = font
+        self.outline = outline
+        self.maxtemp = maxtemp
+        self.bgcolor = bgcolor
+        self.gridcolor = gridcolor
+        self.labelcolor = labelcolor
+        self.outlinecolor = outlinecolor
+
+        self._chromeKey = None
+        self._background = None
+        self._overlay = None
+
+        self._plotKey = None
+        self._plot = None
+        self._count = 0 # samples on the plot surface
+
+    def _propGetRect(self):
+        # Everything the graph draws, scale labels included
+        return pygame.Rect(0, self.top - 12, self.left + self.width + 1, self.height + 14)
+
+    rect = property(_propGetRect)
+
+    def draw(self, surface, series, targets, count):
+        """Draw the graph. Parameters:
+            series - list of (temperatures, color), the temperatures are
+                plotted one pixel apart, oldest first. Each holds the
+                last `width` samples. A third item (mins, maxs, color)
+                adds a band from min to max under each sample, for
+                downsampled histories.
+            targets - list of (temperature, color) horizontal lines.
+            count - number of samples ever added to the series, tells
+                how far the plot has to scroll since the last draw.
+            """
+        self._buildChrome()
+        self._updatePlot(series, count)
+
+        surface.blit(self._background, self.rect)
+        surface.blit(self._plot, (self.left, self.rect.top))
+
+        # Scaling factor
+        g_scale = self.height / float(self.maxtemp)
+
+        # Draw target temperatures
+        for target, color in targets:
+            y = self.top + self.height - (target * g_scale)
+            pygame.draw.line(surface, color, [self.left, y], [self.left + self.width - self.outline, y], 1)
+
+        surface.blit(self._overlay, self._overlayRect())
+
+    def _updatePlot(self, series, count):
+        # A different history (another zoom level) can't be scrolled to
+        key = (self._chromeKey, [(id(entry[0]), entry[1], len(entry)) for entry in series])
+        new = count - self._count
+
+        if key != self._plotKey or new < 0 or new >= self.width:
+            # Replot everything
+            self._plotKey = key
+            self._plot = pygame.Surface((self.width + 1, self.rect.height))
+            if pygame.display.get_surface() is not None:
+                self._plot = self._plot.convert()
+            self._plot.set_colorkey(OVERLAY_KEY)
+            self._plotColumns(series, 0, self.width + 1)
+        elif new > 0:
+            self._plot.scroll(-new, 0)
+            # Every sample is a line two pixels wide: the first column
+            # still shows the half of a sample that scrolled out
+            self._plotColumns(series, 0, 1)
+            self._plotColumns(series, self.width - new, self.width + 1)
+
+        self._count = count
+
+    def _plotColumns(self, series, start, end):
+        """Repaint the plot columns start to end (excluded)."""
+        plot = self._plot
+        g_scale = self.height / float(self.maxtemp)
+        bottom = self.top - self.rect.top + self.height
+
+        plot.set_clip(pygame.Rect(start, 0, end - start, plot.get_height()))
+        plot.fill(OVERLAY_KEY)
+
+        # Bands first, no curve hides under another series' band
+        for entry in series:
+            if len(entry) > 2:
+                mins, maxs, color = entry[2]
+                for i in range(start, min(end, len(mins))):
+                    pygame.draw.line(plot, color, [i, bottom - int(maxs[i] * g_scale)], [i, bottom - int(mins[i] * g_scale)], 1)
+
+        for entry in series:
+            temps, color = entry[0], entry[1]
+            # Sample i covers the columns i and i + 1
+            for i in range(max(start - 1, 0), min(end, len(temps))):
+                y = bottom - int(temps[i] * g_scale)
+                pygame.draw.line(plot, color, [i, y], [i + 1, y], 2)
+
+        plot.set_clip(None)
+
+    def _overlayRect(self):
+        # The outline, with some room for its line width
+        return pygame.Rect(self.left, self.top, self.width, self.height).inflate(self.outline * 2, self.outline * 2)
+
+    def _buildChrome(self):
+        key = (self.left, self.top, self.width, self.height, self.font, self.outline, self.maxtemp,
+               self.bgcolor, self.gridcolor, self.labelcolor, self.outlinecolor)
+        if key == self._chromeKey:
+            return
+        self._chromeKey = key
+
+        rect = self.rect
+        left = self.left - rect.left
+        top = self.top - rect.top
+        height = self.height
+        width = self.width
+
+        background = pygame.Surface(rect.size)
+        background.fill(self.bgcolor)
+
+        # Graph axes
+        # X, temp
+        pygame.draw.line(background, BLACK, [left, top], [left, top + height], 2)
+
+        # X-axis divisions, scale and grey grid lines, every fifth of maxtemp
+        for step in range(6):
+            y = top + (height / 5) * (5 - step)
+            pygame.draw.line(background, BLACK, [left - 3, y], [left, y], 2)
+
+            lbl = self.font.render(str(self.maxtemp / 5 * step), 1, self.labelcolor)
+            background.blit(lbl, (left - 26, top - 6 + (height / 5) * (5 - step) - (height / 22)))
+
+            if 0 < step < 5:
+                pygame.draw.line(background, self.gridcolor, [left + 2, y], [left + width - 2, y], 1)
+
+        # Y, time, 2 seconds per pixel
+        pygame.draw.line(background, BLACK, [left, top + height], [left + width, top + height], 2)
+
+        overlayRect = self._overlayRect()
+        overlay = pygame.Surface(overlayRect.size)
+        overlay.fill(OVERLAY_KEY)
+        draw.draw_roundrect(overlay, self.outlinecolor, pygame.Rect(self.outline, self.outline, width, height), self.outline, 10, 10)
+
+        # Same pixel format as the screen, blits need no conversion
+        if pygame.display.get_surface() is not None:
+            background = background.convert()
+            overlay = overlay.convert()
+        overlay.set_colorkey(OVERLAY_KEY, pygame.RLEACCEL)
+
+        self._background = background
+        self._overlay = overlay
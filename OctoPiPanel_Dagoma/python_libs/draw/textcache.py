@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""
+LRU cache of rendered text surfaces.
+
+Rendering a string with font.render, and even more so outlined with
+hollowtext.textOutline (three renders and five blits), is slow on small
+boards, while the panel draws the same strings frame after frame. All
+text drawing goes through render() which keeps the last `maxsize`
+surfaces, converted to the display format. The returned surfaces are
+shared: blit them, never draw on them.
+"""
+
+from collections import OrderedDict
+import python_libs.draw.hollowtext as hollowtext
+from python_libs.draw.assets import display_format
+
+class SurfaceCache(object):
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._surfaces = OrderedDict()
+
+    def get(self, key, create):
+        """Return the surface cached for key, calling create() to make it
+        if it isn't cached."""
+        surface = self._surfaces.pop(key, None)
+        if surface is None:
+            self.misses += 1
+            surface = create()
+            if len(self._surfaces) >= self.maxsize:
+                # Least recently used is first
+                self._surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+
+        # (Re)inserted last, the most recently used
+        self._surfaces[key] = surface
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+
+    def items(self):
+        """Return the (key, surface) pairs cached."""
+        return self._surfaces.items()
+
+    def stats(self):
+        return { 'hits': self.hits, 'misses': self.misses, 'size': len(self._surfaces), 'maxsize': self.maxsize }
+
+# Shared by all text drawing
+cache = SurfaceCache()
+
+def render(font, text, color, outline=False, outline_color=(1, 1, 1)):
+    """Cached font.render(text, 1, color), or the outlined text if outline."""
+    key = (font, font.get_bold(), font.get_italic(), font.get_underline(), text, tuple(color), outline, tuple(outline_color) if outline else None)
+    if outline:
+        return cache.get(key, lambda: display_format(hollowtext.textOutline(font, text, color, outline_color)))
+    else:
+        return cache.get(key, lambda: display_format(font.render(text, 1, color)))
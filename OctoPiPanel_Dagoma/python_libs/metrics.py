@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+Prometheus metrics.
+
+Counters, histograms and gauges rendered in Prometheus' text exposition
+format, and MetricsServer answering GET /metrics on its own thread.
+Recording a value only takes a lock and bumps a few numbers, a scrape
+never waits for the render loop nor the other way round.
+"""
+
+import os
+import threading
+import BaseHTTPServer
+
+# Seconds, for API round trips and commands
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds, for frames
+FRAME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def _number(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for name, value in escaped) + '}'
+
+class Counter(object):
+    def __init__(self, name, help, label=None):
+        """Create a counter. Parameters:
+            name - metric name, by convention ending in _total.
+            help - one line description.
+            label - optional label name, inc() then counts per label value.
+            """
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {} if label is not None else {None: 0}
+        self._lock = threading.Lock()
+
+    def inc(self, n=1, value=None):
+        """Add n, to the series of label value if the counter has a label."""
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + n
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} counter".format(self.name)]
+        for value, n in values:
+            pairs = [(self.label, value)] if self.label is not None else []
+            lines.append("{0}{1} {2}".format(self.name, _labels(pairs), _number(n)))
+        return lines
+
+class Histogram(object):
+    def __init__(self, name, help, buckets, label=None):
+        """Create a histogram. Parameters:
+            name - metric name, e.g. ending in _seconds.
+            help - one line description.
+            buckets - upper bounds of the buckets, ascending. +Inf is
+                added.
+            label - optional label name, observe() then records per
+                label value.
+            """
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.label = label
+        self._series = {} # label value -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+        if label is None:
+            self._series[None] = [0] * len(self.buckets) + [0.0]
+
+    def observe(self, amount, value=None):
+        """Record amount, in the series of label value if the histogram
+        has a label."""
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0]
+                self._series[value] = series
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += amount
+
+    def lines(self):
+        with self._lock:
+            series = sorted((value, list(counts)) for value, counts in self._series.items())
+        lines = ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} histogram".format(self.name)]
+        for value, counts in series:
+            pairs = [(self.label, value)] if self.label is not None else []
+            # Buckets are cumulative
+            total = 0
+            for bound, n in zip(self.buckets, counts):
+                total += n
+                lines.append("{0}_bucket{1} {2}".format(self.name, _labels(pairs + [('le', _number(bound))]), total))
+            lines.append("{0}_sum{1} {2}".format(self.name, _labels(pairs), _number(counts[-1])))
+            lines.append("{0}_count{1} {2}".format(self.name, _labels(pairs), total))
+        return lines
+
+class Gauge(object):
+    def __init__(self, name, help, read, label=None):
+        """Create a gauge read at each scrape. Parameters:
+            name - metric name.
+            help - one line description.
+            read - callable returning the value, or None to leave the
+                gauge out. With a label it returns {label value: value}.
+                It runs on the server thread.
+            label - optional label name.
+            """
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label = label
+
+    def lines(self):
+        values = self.read()
+        if values is None:
+            return []
+        if self.label is None:
+            values = {None: values}
+        lines = ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} gauge".format(self.name)]
+        for value, n in sorted(values.items()):
+            pairs = [(self.label, value)] if self.label is not None else []
+            lines.append("{0}{1} {2}".format(self.name, _labels(pairs), _number(n)))
+        return lines
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        """Register metric, return it."""
+        self._metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """Return all metrics in the text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines += metric.lines()
+        return "\n".join(lines) + "\n"
+
+def rss_bytes():
+    """Return the resident memory of this process in bytes, or None where
+    /proc isn't there."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # A stuck client can't hold the server for long
+    timeout = 5
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        try:
+            body = self.server.registry.exposition()
+        except Exception as e:
+            # A failing gauge mustn't take the server down
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(threading.Thread):
+    def __init__(self, registry, port, address=''):
+        """Create the server thread, bound to address:port. Raises
+        socket.error if the port can't be bound. Parameters:
+            registry - the Registry scraped.
+            port - TCP port.
+            address - interface to listen on, all of them by default.
+            """
+        threading.Thread.__init__(self, name="MetricsServer")
+        self.daemon = True
+
+        self._server = BaseHTTPServer.HTTPServer((address, port), _Handler)
+        self._server.registry = registry
+
+    def run(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        if self.is_alive():
+            self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+Circuit breaker guarding the OctoPrint API.
+
+closed      requests go through, consecutive failures are counted.
+open        after `threshold` failures: no requests at all until the
+            retry delay has passed.
+half-open   the delay has passed: one cheap probe may go. Success
+            closes the breaker, failure opens it again with the delay
+            doubled, up to `maxbackoff`.
+
+The poller and the push listener both report to the breaker, its state
+changes under a lock.
+"""
+
+import time
+import threading
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitBreaker(object):
+    def __init__(self, threshold=2, backoff=1.0, maxbackoff=60.0):
+        """Parameters:
+            threshold - consecutive failures opening the breaker.
+            backoff - seconds before the first probe.
+            maxbackoff - longest delay between two probes, in seconds.
+            """
+        self.threshold = threshold
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+
+        self.state = CLOSED
+        self.failures = 0
+        self.delay = backoff
+        self.retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request may be made now. An open breaker whose
+        delay has passed becomes half-open and allows its probe."""
+        with self._lock:
+            if self.state == OPEN and time.time() >= self.retry_at:
+                self.state = HALF_OPEN
+            return self.state != OPEN
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.delay = self.backoff
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.delay = min(self.delay * 2, self.maxbackoff)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.threshold:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.retry_at = time.time() + self.delay
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Shared HTTP client for the OctoPrint REST API.
+
+All requests go through one requests.Session so TCP connections are kept
+alive and reused between polls instead of being opened for every call.
+The API key is sent as a default header and every request has a timeout.
+Independent GETs can be fanned out over a small thread pool, so a poll
+costs one round trip instead of the sum of them.
+"""
+
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
+from python_libs.perf import clock
+
+class OctoPrintClient(object):
+    def __init__(self, apikey, timeout=5.0, poolsize=4, fanout=3):
+        """Create a client. Parameters:
+            apikey - sent as X-Api-Key with every request.
+            timeout - default timeout in seconds for connect and read.
+            poolsize - number of keep-alive connections kept to OctoPrint.
+                Should be at least the number of threads using the client.
+            fanout - number of worker threads used by get_json_all.
+            """
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update({ 'X-Api-Key': apikey })
+
+        # A single host, so a single pool holding poolsize connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._fanout = ThreadPool(fanout)
+
+        # Optional function(name, seconds, ok) told the round trip time of
+        # each request of get_json_all, called from its worker threads
+        self.observe = None
+
+    def get(self, url, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return self.session.get(url, timeout=timeout, **kwargs)
+
+    def post(self, url, data, timeout=None):
+        """POST data, a dict, JSON encoded."""
+        if timeout is None:
+            timeout = self.timeout
+        headers = { 'content-type': 'application/json' }
+        return self.session.post(url, data=json.dumps(data), headers=headers, timeout=timeout)
+
+    def get_json(self, url, timeout=None):
+        """GET url and return the decoded JSON reply, or None if the request
+        failed or didn't answer 200."""
+        try:
+            req = self.get(url, timeout)
+        except requests.exceptions.ConnectionError as e:
+            print "Connection Error ({0}): {1}".format(e.errno, e.strerror)
+            return None
+        except requests.exceptions.Timeout as e:
+            print "Timeout: {0}".format(e)
+            return None
+
+        if req.status_code != 200:
+            # 409 is OctoPrint's answer while the printer is disconnected, not worth a line per poll
+            if req.status_code != 409:
+                print "Error {0} from {1}: {2}".format(req.status_code, url, req.text)
+            return None
+
+        try:
+            return json.loads(req.text)
+        except ValueError as e:
+            print "Invalid JSON from {0}: {1}".format(url, e)
+            return None
+
+    def ping(self, url, timeout=None):
+        """Return True if OctoPrint answers a GET of url with a 2xx. A 401
+        or a proxy's 502 means the API is still unusable."""
+        try:
+            req = self.get(url, timeout)
+        except requests.exceptions.RequestException:
+            return False
+        return 200 <= req.status_code < 300
+
+    def get_json_all(self, urls, timeout=None):
+        """GET several URLs concurrently. urls maps a name to an URL, the
+        returned dict maps the same names to what get_json returned, once
+        every request has completed."""
+        pending = dict((name, self._fanout.apply_async(self._get_json_timed, (name, url, timeout)))
+                       for name, url in urls.items())
+        return dict((name, result.get()) for name, result in pending.items())
+
+    def _get_json_timed(self, name, url, timeout):
+        started = clock()
+        reply = self.get_json(url, timeout)
+        if self.observe is not None:
+            self.observe(name, clock() - started, reply is not None)
+        return reply
+
+    def close(self):
+        self._fanout.terminate()
+        self.session.close()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+Asynchronous dispatcher for OctoPrint API commands.
+
+Button handlers queue commands and return at once, a worker thread posts
+them in order. Redundant commands still waiting in the queue are merged:
+consecutive jogs are summed into one jog and a newer target temperature
+replaces the queued one. Finished commands, with their error if any, are
+handed back to the UI through completed().
+"""
+
+import threading
+from collections import deque
+import requests
+from python_libs.perf import clock
+
+# Axes a relative jog moves
+JOG_AXES = ('x', 'y', 'z')
+
+class Command(object):
+    def __init__(self, url, data):
+        self.url = url
+        self.data = dict(data)
+        self.merged = 1 # number of commands sent as this one
+        self.error = None # None once posted successfully
+        self.queued = clock() # of the first command merged into this one
+        self.finished = None # clock() once OctoPrint answered or the post failed
+
+    def merge(self, other):
+        """Fold the later command other into this one if sending only the
+        result has the same effect. Return True if it was merged."""
+        if other.url != self.url or other.data.get('command') != self.data.get('command'):
+            return False
+
+        command = self.data.get('command')
+        if command == 'jog':
+            if self.data.get('absolute') or other.data.get('absolute'):
+                return False
+            for axis in JOG_AXES:
+                if axis in self.data or axis in other.data:
+                    self.data[axis] = self.data.get(axis, 0) + other.data.get(axis, 0)
+            for key in other.data:
+                if key not in JOG_AXES:
+                    self.data[key] = other.data[key]
+        elif command == 'target':
+            # Latest target wins, per tool
+            if 'targets' in self.data and 'targets' in other.data:
+                targets = dict(self.data['targets'])
+                targets.update(other.data['targets'])
+                self.data['targets'] = targets
+            elif 'target' in self.data and 'target' in other.data:
+                self.data['target'] = other.data['target']
+            else:
+                return False
+        else:
+            return False
+
+        self.merged += other.merged
+        return True
+
+class CommandDispatcher(threading.Thread):
+    def __init__(self, client, maxsize=16, notify=None):
+        """Create a dispatcher thread. Parameters:
+            client - the OctoPrintClient used to post commands.
+            maxsize - commands waiting at most, send() refuses more.
+            notify - optional callable run, without arguments, on the
+                dispatcher thread each time a command is finished.
+            """
+        threading.Thread.__init__(self, name="CommandDispatcher")
+        self.daemon = True
+
+        self.client = client
+        self.maxsize = maxsize
+        self.notify = notify
+
+        self._pending = deque()
+        self._done = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def send(self, url, data):
+        """Queue a command, return False if the queue is full."""
+        command = Command(url, data)
+
+        with self._cond:
+            # Merge only with the command right before it, never across
+            # another command, a jog must not move past a job command
+            if self._pending and self._pending[-1].merge(command):
+                return True
+
+            if len(self._pending) >= self.maxsize:
+                return False
+
+            self._pending.append(command)
+            self._cond.notify()
+
+        return True
+
+    def completed(self):
+        """Return the commands finished since the last call, oldest first."""
+        done = []
+        while self._done:
+            done.append(self._done.popleft())
+        return done
+
+    def pending(self):
+        return len(self._pending)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                command = self._pending.popleft()
+
+            try:
+                req = self.client.post(command.url, command.data)
+                if req.status_code >= 300:
+                    command.error = "HTTP {0}: {1}".format(req.status_code, req.text.strip())
+            except requests.exceptions.RequestException as e:
+                command.error = str(e)
+
+            command.finished = clock()
+            self._done.append(command)
+            if self.notify is not None:
+                self.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""
+Fixed capacity temperature history.
+
+All series (tool0, tool1, bed, chamber...) live in one array('f') block,
+4 bytes a sample instead of a boxed float in a deque. Each series is
+stored twice in a row: a sample is written at its ring position and
+`capacity` further, so the last `capacity` samples are always one
+contiguous run of the block, starting at the oldest. Appending is O(1)
+and reading them in order needs no copy and no wrap-around arithmetic.
+
+TieredHistory adds coarser levels on top of that: the samples are also
+folded into time buckets (1 and 10 minutes by default) and only the
+min, max and mean of every bucket is kept. The same number of points
+then covers hours of history.
+
+With an interval the raw samples are kept on a fixed time grid, one
+per interval whatever the poll rate: faster samples only reach the
+tiers, the columns a slower poll skipped are interpolated.
+
+After a (re)start the history can be seeded from OctoPrint's own
+temperature history, resampled onto the graph's time axis.
+"""
+
+import time
+from array import array
+
+SERIES = ('tool0', 'tool1', 'bed', 'chamber')
+
+class SeriesView(object):
+    """Live, read only, oldest first view of one series of a RingBuffer.
+    It follows the appends made after it was created."""
+    def __init__(self, ring, index):
+        self._ring = ring
+        self._base = index * ring.capacity * 2
+
+    def __len__(self):
+        return self._ring.capacity
+
+    def __getitem__(self, i):
+        ring = self._ring
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(ring.capacity))]
+        if i < 0:
+            i += ring.capacity
+        if not 0 <= i < ring.capacity:
+            raise IndexError("history index out of range")
+        return ring._data[self._base + ring._head + i]
+
+    def __iter__(self):
+        ring = self._ring
+        start = self._base + ring._head
+        data = ring._data
+        for i in xrange(start, start + ring.capacity):
+            yield data[i]
+
+class RingBuffer(object):
+    def __init__(self, capacity, series=SERIES, fill=0.0, typecode='f'):
+        """Create a history of capacity samples per series. Parameters:
+            capacity - samples kept per series.
+            series - names of the series.
+            fill - value of the samples not added yet.
+            typecode - array typecode of the samples.
+            """
+        self.capacity = capacity
+        self.series = tuple(series)
+        self.count = 0 # samples ever appended
+
+        self._index = dict((name, i) for i, name in enumerate(self.series))
+        self._views = {}
+        self._data = array(typecode, [fill]) * (len(self.series) * capacity * 2)
+        self._head = 0 # ring position of the oldest sample
+
+    def append(self, values):
+        """Add one sample to every series. values maps series names to
+        temperatures, the series it leaves out get 0."""
+        capacity = self.capacity
+        data = self._data
+        pos = self._head
+        for i, name in enumerate(self.series):
+            value = values.get(name, 0.0)
+            base = i * capacity * 2
+            data[base + pos] = value
+            data[base + pos + capacity] = value
+
+        self._head = (pos + 1) % capacity
+        self.count += 1
+
+    def view(self, name):
+        """Return the SeriesView of series name, always the same object."""
+        view = self._views.get(name)
+        if view is None:
+            view = SeriesView(self, self._index[name])
+            self._views[name] = view
+        return view
+
+    def envelope(self, name):
+        """Return the (min, max) views of series name, None as every
+        sample is its own min and max."""
+        return None
+
+    def last(self, name):
+        """Return the newest sample of series name."""
+        return self._data[self._index[name] * self.capacity * 2 + self._head + self.capacity - 1]
+
+class Tier(object):
+    def __init__(self, seconds, capacity, series=SERIES):
+        """Create a history level of capacity buckets per series.
+        Parameters:
+            seconds - duration of a bucket.
+            capacity - buckets kept per series.
+            series - names of the series.
+            """
+        self.seconds = seconds
+        self.capacity = capacity
+        self.series = tuple(series)
+
+        self.mean = RingBuffer(capacity, series)
+        self.min = RingBuffer(capacity, series)
+        self.max = RingBuffer(capacity, series)
+
+        # The bucket being filled, only added to the rings once complete
+        self._bucket = None
+        self._reset()
+
+    def _propGetCount(self):
+        return self.mean.count
+
+    count = property(_propGetCount)
+
+    def _reset(self):
+        self._n = 0
+        self._sum = dict((name, 0.0) for name in self.series)
+        self._min = {}
+        self._max = {}
+
+    def add(self, values, timestamp):
+        """Fold one sample taken at timestamp (seconds) into its bucket."""
+        bucket = int(timestamp // self.seconds)
+        if bucket != self._bucket:
+            self.flush()
+            self._bucket = bucket
+
+        for name in self.series:
+            value = values.get(name, 0.0)
+            self._sum[name] += value
+            self._min[name] = min(self._min.get(name, value), value)
+            self._max[name] = max(self._max.get(name, value), value)
+        self._n += 1
+
+    def flush(self):
+        """Add the bucket being filled to the rings. Buckets without
+        samples, e.g. while OctoPrint was unreachable, are skipped."""
+        if self._n:
+            self.mean.append(dict((name, self._sum[name] / self._n) for name in self.series))
+            self.min.append(self._min)
+            self.max.append(self._max)
+        self._reset()
+
+    def view(self, name):
+        """Return the view of the bucket means of series name."""
+        return self.mean.view(name)
+
+    def envelope(self, name):
+        """Return the (min, max) views of series name."""
+        return self.min.view(name), self.max.view(name)
+
+class TieredHistory(object):
+    def __init__(self, capacity, buckets=(60, 600), series=SERIES, interval=None):
+        """Create a full resolution history of capacity samples, plus one
+        Tier of capacity buckets for each bucket duration (seconds). With
+        interval (seconds) the raw samples are that far apart, else every
+        sample appended is one raw sample."""
+        self.raw = RingBuffer(capacity, series)
+        self.tiers = [Tier(seconds, capacity, series) for seconds in buckets]
+        self.interval = interval
+        self.last = None # timestamp of the newest sample
+        self.rawLast = None # timestamp of the newest raw sample
+
+        # Zoom levels, finest first: raw samples, then the tiers
+        self.levels = [self.raw] + self.tiers
+
+    def append(self, values, timestamp=None):
+        """Add one sample to every level, see RingBuffer.append."""
+        if timestamp is None:
+            timestamp = time.time()
+        self._append_raw(values, timestamp)
+        for tier in self.tiers:
+            tier.add(values, timestamp)
+        self.last = timestamp
+
+    def _append_raw(self, values, timestamp):
+        # Nothing to align to yet, or the clock went back (the grid itself
+        # may be up to a quarter interval ahead)
+        if self.interval is None or self.rawLast is None or timestamp < self.rawLast - self.interval:
+            self.raw.append(values)
+            self.rawLast = timestamp
+            return
+
+        # A quarter interval early still counts, poll timing jitters
+        slots = int((timestamp - self.rawLast) / self.interval + 0.25)
+        if slots < 1:
+            return
+        self.rawLast += slots * self.interval
+
+        slots = min(slots, self.raw.capacity)
+        previous = dict((name, self.raw.last(name)) for name in values)
+        for slot in range(1, slots + 1):
+            weight = float(slot) / slots
+            self.raw.append(dict((name, previous[name] + (value - previous[name]) * weight) for name, value in values.items()))
+
+    def backfill(self, samples, interval, now=None):
+        """Replace the raw samples with samples, a list of (timestamp,
+        values) oldest first, resampled interval seconds apart. The newest
+        sample is taken as `now`, which also takes care of a clock offset
+        between OctoPrint and the panel. The tiers get the samples as they
+        are, only those newer than what they already hold."""
+        if not samples:
+            return
+        if now is None:
+            now = time.time()
+
+        for timestamp, values in resample(samples, interval, self.raw.capacity):
+            self.raw.append(values)
+        self.rawLast = now
+
+        shift = now - samples[-1][0]
+        for timestamp, values in samples:
+            timestamp += shift
+            if self.last is None or timestamp > self.last:
+                for tier in self.tiers:
+                    tier.add(values, timestamp)
+                self.last = timestamp
+
+def resample(samples, interval, count):
+    """Return count (timestamp, values) points interval seconds apart,
+    the last one at the time of the last of samples, a list of
+    (timestamp, values) oldest first. Values are interpolated linearly
+    between the two samples around each point, points older than the
+    first sample get no values."""
+    points = []
+    end = samples[-1][0]
+    i = 0
+    for k in range(count - 1, -1, -1):
+        t = end - k * interval
+
+        # samples[i] is the last sample at or before t
+        while i + 1 < len(samples) and samples[i + 1][0] <= t:
+            i += 1
+
+        before = samples[i]
+        if before[0] > t:
+            values = {}
+        elif before[0] == t or i + 1 == len(samples):
+            values = dict(before[1])
+        else:
+            after = samples[i + 1]
+            weight = (t - before[0]) / float(after[0] - before[0])
+            values = dict((name, value + (after[1][name] - value) * weight)
+                          for name, value in before[1].items() if name in after[1])
+
+        points.append((t, values))
+    return points
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+Background acquisition of the printer state.
+
+The poller thread calls a fetch function every `interval` seconds and
+publishes the immutable PrinterState it returns. The UI loop only ever
+reads the latest published snapshot, so a slow or unreachable OctoPrint
+never blocks event handling or drawing.
+"""
+
+import time
+import threading
+from collections import namedtuple
+
+PrinterState = namedtuple('PrinterState', [
+    'HotEndTemp',
+    'BedTemp',
+    'HotEndTempTarget',
+    'BedTempTarget',
+    'HotHotEnd',
+    'HotBed',
+    'Paused',
+    'Printing',
+    'JobLoaded',
+    'Completion',       # In procent
+    'PrintTimeLeft',
+    'Height',
+    'FileName',
+    'Sample',           # Counts temperature samples for the graph
+    'Online',           # False while OctoPrint can't be reached
+    'Backfill',         # Temperature history to seed the graph with, see TieredHistory.backfill
+    ])
+
+EMPTY_STATE = PrinterState(
+    HotEndTemp = 0.0,
+    BedTemp = 0.0,
+    HotEndTempTarget = 0.0,
+    BedTempTarget = 0.0,
+    HotHotEnd = False,
+    HotBed = False,
+    Paused = False,
+    Printing = False,
+    JobLoaded = False,
+    Completion = 0,
+    PrintTimeLeft = 0,
+    Height = 0.0,
+    FileName = "Nothing",
+    Sample = 0,
+    Online = True,
+    Backfill = None)
+
+class StatePoller(threading.Thread):
+    def __init__(self, fetch, interval, initial=EMPTY_STATE, notify=None):
+        """Create a poller thread. Parameters:
+            fetch - callable taking the previous PrinterState and returning
+                the new one. It runs on the poller thread only.
+            interval - seconds between two fetches.
+            initial - the snapshot published before the first fetch.
+            notify - optional callable run, without arguments, after each
+                new snapshot. It runs on the publishing thread, use it to
+                wake the UI loop up.
+            """
+        threading.Thread.__init__(self, name="StatePoller")
+        self.daemon = True
+
+        self.fetch = fetch
+        self.interval = interval
+        self.notify = notify
+
+        self._lock = threading.Lock()
+        self._state = initial
+        self._seq = 0
+        self._stopEvent = threading.Event()
+        self._wakeEvent = threading.Event()
+        self._pollNow = False
+
+    def run(self):
+        while not self._stopEvent.is_set():
+            started = time.time()
+            self._wakeEvent.clear()
+
+            try:
+                state = self.fetch(self.latest()[1])
+            except Exception as e:
+                # Never let the thread die, the panel would freeze on stale data
+                print "StatePoller: fetch failed: {0}".format(e)
+            else:
+                if state is not None:
+                    self.publish(state)
+
+            # Wait out the interval, a new interval applies to this wait too
+            while not self._stopEvent.is_set() and not self._pollNow:
+                remaining = self.interval - (time.time() - started)
+                if remaining <= 0:
+                    break
+                self._wakeEvent.wait(remaining)
+                self._wakeEvent.clear()
+            self._pollNow = False
+
+    def publish(self, state):
+        """Make state the latest snapshot."""
+        with self._lock:
+            self._state = state
+            self._seq += 1
+        self._notify()
+
+    def update(self, change):
+        """Publish change(latest snapshot) as the new snapshot, atomically.
+        Used by other threads feeding the state, e.g. push updates. change
+        runs under the lock latest() takes, keep it short. Return the new
+        snapshot, None if change returned None."""
+        with self._lock:
+            state = change(self._state)
+            if state is not None:
+                self._state = state
+                self._seq += 1
+        if state is not None:
+            self._notify()
+        return state
+
+    def _notify(self):
+        if self.notify is not None:
+            self.notify()
+
+    def latest(self):
+        """Return (sequence number, snapshot) of the latest published state.
+        The sequence number only grows, compare it to detect new snapshots."""
+        with self._lock:
+            return self._seq, self._state
+
+    def poll_now(self):
+        """Fetch right away instead of waiting for the interval to end."""
+        self._pollNow = True
+        self._wakeEvent.set()
+
+    def set_interval(self, interval):
+        """Change the seconds between two fetches. The wait under way is
+        cut short or extended to the new interval."""
+        if interval != self.interval:
+            self.interval = interval
+            self._wakeEvent.set()
+
+    def stop(self):
+        self._stopEvent.set()
+        self._wakeEvent.set()
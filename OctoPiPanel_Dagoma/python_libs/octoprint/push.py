@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+Listener for OctoPrint's SockJS push API.
+
+OctoPrint pushes 'current' (about twice a second) and 'history' (once,
+after connecting) messages on /sockjs. This uses SockJS' xhr_streaming
+transport, plain HTTP through the shared OctoPrintClient session, so no
+websocket library is needed. Frames are:
+    o               session open
+    h               heartbeat
+    a["...", ...]   array of JSON encoded messages
+    c[code, "why"]  session closed
+"""
+
+import json
+import random
+import string
+import threading
+import requests
+
+class PushListener(threading.Thread):
+    def __init__(self, client, baseurl, on_message, retrydelay=5.0, timeout=60.0):
+        """Create a listener thread. Parameters:
+            client - the OctoPrintClient to connect with.
+            baseurl - the OctoPrint URL, e.g. http://localhost:5000
+            on_message - callable taking (type, payload) for every message,
+                e.g. ('current', {...}). Runs on the listener thread.
+            retrydelay - seconds to wait before reconnecting.
+            timeout - seconds without any frame, heartbeats included,
+                before the connection is considered dead.
+            """
+        threading.Thread.__init__(self, name="PushListener")
+        self.daemon = True
+
+        self.client = client
+        self.baseurl = baseurl.rstrip('/')
+        self.on_message = on_message
+        self.retrydelay = retrydelay
+        self.timeout = timeout
+
+        # True while the stream is open, the poller falls back when it's not
+        self.connected = False
+
+        self._stream = None
+        self._stopEvent = threading.Event()
+
+    def run(self):
+        while not self._stopEvent.is_set():
+            try:
+                self._listen()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if not self._stopEvent.is_set():
+                    print "Push connection lost: {0}".format(e)
+            except Exception as e:
+                if not self._stopEvent.is_set():
+                    print "PushListener: {0}".format(e)
+
+            self.connected = False
+            self._stopEvent.wait(self.retrydelay)
+
+    def _listen(self):
+        server = random.randint(0, 999)
+        session = ''.join(random.choice(string.ascii_lowercase + string.digits) for i in range(8))
+        sessionurl = '{0}/sockjs/{1:03d}/{2}'.format(self.baseurl, server, session)
+
+        self._stream = self.client.session.post(sessionurl + '/xhr_streaming', stream=True, timeout=(self.client.timeout, self.timeout))
+        try:
+            self._stream.raise_for_status()
+
+            for line in self._stream.iter_lines(chunk_size=1024):
+                if self._stopEvent.is_set():
+                    return
+
+                if line == 'o':
+                    self._authenticate(sessionurl)
+                    self.connected = True
+                elif line.startswith('a'):
+                    for frame in json.loads(line[1:]):
+                        message = json.loads(frame)
+                        for key, payload in message.items():
+                            self.on_message(key, payload)
+                elif line.startswith('c'):
+                    print "Push session closed: {0}".format(line[1:])
+                    return
+                # 'h' heartbeats and the 'hhh...' prelude only keep the stream alive
+        finally:
+            self._stream.close()
+            self._stream = None
+
+    def _authenticate(self, sessionurl):
+        # OctoPrint >= 1.3.10 only pushes to authenticated sockets, older
+        # versions don't know passive logins and push to anyone.
+        try:
+            req = self.client.post('{0}/api/login'.format(self.baseurl), { 'passive': True })
+        except requests.exceptions.RequestException as e:
+            print "Push login failed: {0}".format(e)
+            return
+
+        if req.status_code != 200:
+            return
+
+        user = json.loads(req.text)
+        if 'name' in user and 'session' in user:
+            auth = json.dumps({ 'auth': '{0}:{1}'.format(user['name'], user['session']) })
+            self.client.session.post(sessionurl + '/xhr_send', data=json.dumps([auth]), timeout=self.client.timeout)
+
+    def stop(self):
+        self._stopEvent.set()
+        stream = self._stream
+        if stream is not None:
+            # Unblocks iter_lines
+            stream.close()
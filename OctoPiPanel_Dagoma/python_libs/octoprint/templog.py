@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+Append-only binary temperature log.
+
+Every sample is one fixed size record: timestamp, tool actual and
+target, bed actual and target (little endian double and four floats,
+24 bytes). A file starts with a 16 bytes header, the magic string, the
+format version and the record size. Records are only ever appended, a
+crash can at worst leave a partial record at the end, which readers
+ignore.
+
+The writer keeps records in the file buffer and only flushes and fsyncs
+them every `syncinterval` seconds, an SD card doesn't like a sync per
+sample. A new file is started for every print job, and for the idle time
+between jobs.
+
+Readers map the file (mmap) and unpack records on demand, scanning a
+day of samples never builds Python lists of it. Run this module with log
+files as arguments to dump them as CSV.
+"""
+
+import os
+import re
+import sys
+import mmap
+import time
+import struct
+import bisect
+import threading
+
+MAGIC = 'OPPTLOG1'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<dffff') # timestamp, tool actual, tool target, bed actual, bed target
+
+class TemperatureLog(object):
+    def __init__(self, directory, syncinterval=30.0):
+        """Create a log writing to files in directory. Parameters:
+            directory - where the log files go, created if needed.
+            syncinterval - seconds between two fsyncs.
+            """
+        self.directory = directory
+        self.syncinterval = syncinterval
+        self.path = None # file being written
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._synced = 0.0
+
+    def rotate(self, job=None, timestamp=None):
+        """Close the current file and start a new one, named after the
+        time and job (a print job file name, None between jobs)."""
+        if timestamp is None:
+            timestamp = time.time()
+
+        name = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+        if job:
+            name += '-' + re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.splitext(job)[0])
+        else:
+            name += '-idle'
+
+        with self._lock:
+            self._close()
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                self.path = os.path.join(self.directory, name + '.tlog')
+                self._file = open(self.path, 'ab')
+                if self._file.tell() == 0:
+                    self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+                self._synced = time.time()
+            except (IOError, OSError) as e:
+                # The panel works without its log
+                print "Temperature log: can't open {0}: {1}".format(self.path, e)
+                self._file = None
+
+    def append(self, timestamp, toolActual, toolTarget, bedActual, bedTarget):
+        """Add one record, fsync if the last sync is syncinterval old."""
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.write(RECORD.pack(timestamp, toolActual or 0.0, toolTarget or 0.0, bedActual or 0.0, bedTarget or 0.0))
+                if time.time() - self._synced >= self.syncinterval:
+                    self._sync()
+            except (IOError, OSError) as e:
+                print "Temperature log: write to {0} failed: {1}".format(self.path, e)
+                self._close()
+
+    def flush(self):
+        """Write and fsync the buffered records now."""
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced = time.time()
+
+    def _close(self):
+        if self._file is None:
+            return
+        try:
+            self._sync()
+            self._file.close()
+        except (IOError, OSError) as e:
+            print "Temperature log: closing {0} failed: {1}".format(self.path, e)
+        self._file = None
+
+class _Timestamps(object):
+    # Sequence of the record timestamps, for bisect
+    def __init__(self, reader):
+        self._reader = reader
+
+    def __len__(self):
+        return len(self._reader)
+
+    def __getitem__(self, i):
+        return self._reader[i][0]
+
+class TemperatureLogReader(object):
+    def __init__(self, path):
+        """Map the log file at path. Records appended after that are not
+        seen, open a new reader for them."""
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+
+        self._map = None
+        self._count = 0
+        if size >= HEADER.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, recordsize = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or recordsize != RECORD.size:
+                self.close()
+                raise ValueError("{0} is not a temperature log".format(path))
+            # A partial record at the end was being written, skip it
+            self._count = (size - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        """Return record i as (timestamp, tool actual, tool target, bed
+        actual, bed target)."""
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("record index out of range")
+        return RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self[i]
+
+    def between(self, start, end):
+        """Iterate over the records from start to end (timestamps,
+        included). Records are appended in time order, the first one is
+        found by bisection."""
+        i = bisect.bisect_left(_Timestamps(self), start)
+        while i < self._count:
+            record = self[i]
+            if record[0] > end:
+                break
+            yield record
+            i += 1
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+if __name__ == '__main__':
+    # Dump log files as CSV
+    print "time,tool_actual,tool_target,bed_actual,bed_target"
+    for path in sys.argv[1:]:
+        reader = TemperatureLogReader(path)
+        for record in reader:
+            print "{0:.3f},{1:.2f},{2:.2f},{3:.2f},{4:.2f}".format(*record)
+        reader.close()
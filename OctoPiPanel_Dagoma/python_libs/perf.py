@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+Frame timing.
+
+StageTimes collects how long each stage of a frame took. Stages report
+their durations with add() while a frame runs, end_frame() then keeps
+one total per stage for that frame. The last `keep` frames of every
+stage are kept, summary() gives their percentiles.
+
+LoopStats instruments the running panel: main loop stages, API round
+trips and counters, readable from any thread.
+
+clock() is monotonic where the system has a monotonic clock, durations
+are not thrown off when NTP sets the time.
+"""
+
+import os
+import time
+import ctypes
+import ctypes.util
+import threading
+from collections import deque
+
+CLOCK_MONOTONIC = 1 # linux/time.h
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _monotonic():
+    # Return clock_gettime(CLOCK_MONOTONIC) as a function, or None
+    for name in (ctypes.util.find_library('rt'), ctypes.util.find_library('c')):
+        if name is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(name, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+        def monotonic():
+            ts = _timespec() # one per call, clock() is used by several threads
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+
+        try:
+            monotonic()
+        except OSError:
+            continue
+        return monotonic
+    return None
+
+# Stage durations are differences of clock() values, in seconds
+clock = getattr(time, 'monotonic', None) or _monotonic() or time.time
+
+def percentile(values, p):
+    """Return the p-th percentile (0 to 100) of the sorted values,
+    nearest rank."""
+    if not values:
+        return 0.0
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[max(0, min(rank, len(values) - 1))]
+
+class StageTimes(object):
+    def __init__(self, keep=1000, group=None):
+        """Create empty timings. Parameters:
+            keep - frames kept per stage.
+            group - optional function mapping the stage names given to
+                add() to the name they are reported under.
+            """
+        self.keep = keep
+        self.group = group
+        self.frames = 0
+        self._frame = {}
+        self._samples = {}
+
+    def add(self, stage, seconds):
+        """Add seconds to stage in the current frame."""
+        if self.group is not None:
+            stage = self.group(stage)
+        self._frame[stage] = self._frame.get(stage, 0.0) + seconds
+
+    def end_frame(self):
+        """Close the current frame."""
+        for stage, seconds in self._frame.items():
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = deque(maxlen=self.keep)
+                self._samples[stage] = samples
+            samples.append(seconds)
+        self._frame = {}
+        self.frames += 1
+
+    def stages(self):
+        return sorted(self._samples)
+
+    def summary(self):
+        """Return {stage: {'count', 'mean', 'p50', 'p90', 'p99', 'max'}},
+        in milliseconds, over the frames kept. count is the number of
+        frames in which the stage ran."""
+        result = {}
+        for stage, samples in self._samples.items():
+            values = sorted(samples)
+            result[stage] = {
+                'count': len(values),
+                'mean': sum(values) / len(values) * 1000.0,
+                'p50': percentile(values, 50) * 1000.0,
+                'p90': percentile(values, 90) * 1000.0,
+                'p99': percentile(values, 99) * 1000.0,
+                'max': values[-1] * 1000.0 }
+        return result
+
+    def report(self):
+        """Return the summary as a text table."""
+        lines = ["{0:<12} {1:>6} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8}".format('stage (ms)', 'frames', 'mean', 'p50', 'p90', 'p99', 'max')]
+        summary = self.summary()
+        for stage in self.stages():
+            s = summary[stage]
+            lines.append("{0:<12} {1:>6} {2:>8.3f} {3:>8.3f} {4:>8.3f} {5:>8.3f} {6:>8.3f}".format(stage, s['count'], s['mean'], s['p50'], s['p90'], s['p99'], s['max']))
+        return "\n".join(lines)
+
+    def reset(self):
+        self.frames = 0
+        self._frame = {}
+        self._samples = {}
+
+class LoopStats(object):
+    def __init__(self, keep=300):
+        """Create empty statistics. Parameters:
+            keep - frames, and API requests per endpoint, kept for the
+                percentiles.
+            """
+        self.loop = StageTimes(keep) # stages of the main loop, main thread only
+        self.api = StageTimes(keep)  # round trips, each request counts as a frame
+        self._counters = {}
+        self._frameEnds = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """Add seconds to stage in the current loop. Main thread only."""
+        self.loop.add(stage, seconds)
+
+    def lap(self, stage, since):
+        """Add the time from the clock() value since to now to stage,
+        return now. Main thread only."""
+        now = clock()
+        self.loop.add(stage, now - since)
+        return now
+
+    def end_frame(self, started):
+        """Close the loop that started at the clock() value started, its
+        total goes to the 'loop' stage and is returned. Main thread only."""
+        now = clock()
+        self.loop.add('loop', now - started)
+        with self._lock:
+            self.loop.end_frame()
+            self._frameEnds.append(now)
+        return now - started
+
+    def request(self, name, seconds, ok=True):
+        """Record an API round trip to endpoint name. Any thread."""
+        with self._lock:
+            self.api.add(name, seconds)
+            self.api.end_frame()
+            self._count('api requests', 1)
+            if not ok:
+                self._count('api errors', 1)
+
+    def count(self, name, n=1):
+        """Add n to the counter name. Any thread."""
+        with self._lock:
+            self._count(name, n)
+
+    def _count(self, name, n):
+        self._counters[name] = self._counters.get(name, 0) + n
+
+    def _fps(self, window):
+        now = clock()
+        return sum(1 for end in self._frameEnds if end > now - window) / float(window)
+
+    def fps(self, window=5.0):
+        """Return the loops per second over the last window seconds."""
+        with self._lock:
+            return self._fps(window)
+
+    def snapshot(self):
+        """Return all numbers as a dict: 'fps', 'frames', 'loop' and 'api'
+        (StageTimes summaries, in ms) and 'counters'. Any thread."""
+        with self._lock:
+            return {
+                'fps': self._fps(5.0),
+                'frames': self.loop.frames,
+                'loop': self.loop.summary(),
+                'api': self.api.summary(),
+                'counters': dict(self._counters) }
+
+    def report(self):
+        """Return the main numbers as one line of text, for logs."""
+        snapshot = self.snapshot()
+        loop = snapshot['loop'].get('loop')
+        poll = snapshot['api'].get('poll')
+        parts = ["{0:.1f} fps".format(snapshot['fps'])]
+        if loop is not None:
+            parts.append("loop p50 {0:.1f} p99 {1:.1f} ms".format(loop['p50'], loop['p99']))
+        if poll is not None:
+            parts.append("poll p50 {0:.0f} p99 {1:.0f} ms".format(poll['p50'], poll['p99']))
+        parts += ["{0} {1}".format(name, n) for name, n in sorted(snapshot['counters'].items())]
+        return ", ".join(parts)